@@ -0,0 +1,224 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+from capture import frame_digest
+from memory import image_nbytes
+
+ARCHIVE_FORMATS = {
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+
+# Number of recent frame digests remembered for deduplication
+DEDUP_HISTORY = 256
+
+# Names written by _write_batch: <YYYYmmdd-HHMMSS>-<millis>_<digest prefix><extension>.
+# Retention only ever touches files matching this, never anything else in screenshot_dir
+ARCHIVE_NAME = re.compile(
+    r"\d{8}-\d{6}-\d{3}_[0-9a-f]{12}(%s)" % "|".join(re.escape(ext) for _, ext in ARCHIVE_FORMATS.values())
+)
+
+
+class ScreenshotArchiver:
+    """Optional background archive of captured frames
+
+    `submit` only enqueues the frame and never blocks: when the queue is full
+    the frame is dropped. Frames are encoded in a thread pool, written in
+    batches by a single writer thread, deduplicated by content hash and
+    pruned by age and total size after every batch.
+    """
+
+    def __init__(self):
+        self.enabled = settings.archive_screenshots
+        self.directory = settings.screenshot_dir
+        self.format, self.extension = ARCHIVE_FORMATS.get(settings.archive_format.lower(), ARCHIVE_FORMATS["jpeg"])
+        self.max_bytes = settings.archive_max_mb * 1024 * 1024
+        self.max_age = settings.archive_max_age_hours * 3600
+
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._encoder: Optional[ThreadPoolExecutor] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        # (mtime, path, size) for archived files, oldest first
+        self._files: deque = deque()
+        self._total_bytes = 0
+        # Pixel bytes of frames waiting in the queue or being encoded
+        self.queued_bytes = 0
+        # Set under memory pressure: frames are dropped instead of queued
+        self.paused = False
+
+        self.submitted = 0
+        self.archived = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def start(self):
+        """Start the archive worker if archiving is enabled"""
+        if not self.enabled or self._task:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = asyncio.Queue(maxsize=settings.archive_queue_size)
+        self._encoder = ThreadPoolExecutor(max_workers=settings.archive_workers, thread_name_prefix="archive-encode")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-write")
+        self._task = asyncio.create_task(self._run())
+        print(f"Archiving screenshots to {self.directory} as {self.format}")
+
+    async def stop(self):
+        """Flush queued frames and stop the worker"""
+        if not self._task:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=5)
+        except asyncio.TimeoutError:
+            print("Screenshot archive did not flush in time, dropping queued frames")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._encoder.shutdown(wait=False)
+        self._writer.shutdown(wait=True)
+
+    def submit(self, img: Image.Image, digest: Optional[str] = None) -> bool:
+        """Queue a frame for archiving without waiting"""
+        if not self._task:
+            return False
+        self.submitted += 1
+        if digest is not None and digest in self._seen:
+            self.duplicates += 1
+            return False
+        if self.paused:
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((time.time(), img, digest))
+            self.queued_bytes += image_nbytes(img)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def _run(self):
+        """Pull frames in batches, encode them in the pool and write each batch at once"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._scan_existing)
+
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < settings.archive_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                encoded = await asyncio.gather(*(
+                    loop.run_in_executor(self._encoder, self._encode, timestamp, img, digest)
+                    for timestamp, img, digest in batch
+                ))
+                encoded = [item for item in encoded if self._remember(item[1])]
+                if encoded:
+                    await loop.run_in_executor(self._writer, self._write_batch, encoded)
+            except Exception as e:
+                print(f"Error archiving screenshots: {e}")
+            finally:
+                for _, img, _ in batch:
+                    self.queued_bytes -= image_nbytes(img)
+                    self.queue.task_done()
+
+    def _remember(self, digest: str) -> bool:
+        """Record a digest; False if it was archived recently"""
+        if digest in self._seen:
+            self._seen.move_to_end(digest)
+            self.duplicates += 1
+            return False
+        self._seen[digest] = None
+        if len(self._seen) > DEDUP_HISTORY:
+            self._seen.popitem(last=False)
+        return True
+
+    def _encode(self, timestamp: float, img: Image.Image, digest: Optional[str]) -> Tuple[float, str, bytes]:
+        """Encode a frame (runs in the encoder pool)"""
+        if digest is None:
+            digest = frame_digest(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer = BytesIO()
+        if self.format == "WEBP":
+            img.save(buffer, format="WEBP", quality=settings.capture_quality, method=4)
+        else:
+            img.save(buffer, format="JPEG", quality=settings.capture_quality, optimize=False)
+        return timestamp, digest, buffer.getvalue()
+
+    def _write_batch(self, encoded: List[Tuple[float, str, bytes]]):
+        """Write a batch of encoded frames and apply retention (runs in the writer thread)"""
+        for timestamp, digest, data in encoded:
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp))
+            millis = int((timestamp % 1) * 1000)
+            path = os.path.join(self.directory, f"{stamp}-{millis:03d}_{digest[:12]}{self.extension}")
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._files.append((timestamp, path, len(data)))
+            self._total_bytes += len(data)
+            self.archived += 1
+        self._apply_retention()
+
+    def _scan_existing(self):
+        """Index archive files left from previous runs so retention covers them"""
+        existing = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and ARCHIVE_NAME.fullmatch(entry.name):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.path, stat.st_size))
+        existing.sort()
+        self._files.extend(existing)
+        self._total_bytes += sum(size for _, _, size in existing)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        """Delete the oldest files beyond the age or size limits"""
+        cutoff = time.time() - self.max_age if self.max_age > 0 else None
+        while self._files:
+            mtime, path, size = self._files[0]
+            too_old = cutoff is not None and mtime < cutoff
+            too_big = self.max_bytes > 0 and self._total_bytes > self.max_bytes
+            if not (too_old or too_big):
+                break
+            self._files.popleft()
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not remove archived screenshot {path}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get archive statistics"""
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "format": self.format,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "queued_bytes": self.queued_bytes,
+            "paused": self.paused,
+            "submitted": self.submitted,
+            "archived": self.archived,
+            "duplicates": self.duplicates,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "files": len(self._files),
+            "total_bytes": self._total_bytes,
+        }
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+from keywords import get_classifier
+from memory import deep_sizeof
+
+# Seconds between /health re-checks while the inference server reports no model loaded
+HEALTH_REPROBE_INTERVAL = 5.0
+
+
+class VisionBackend:
+    """Interface shared by every way of running the vision model
+
+    Subclasses implement `load_model` and `analyze_screenshot`. Context
+    tracking, the heuristic path and the mock fallback live here so they
+    behave the same whether inference runs in-process, in a replica pool or
+    in a separate inference server.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.context_buffer = deque(maxlen=settings.max_context_buffer)
+        self.classifier = get_classifier()
+        self.is_loaded = False
+        # Image size (width, height) the model's processor resizes to, if known
+        self.input_size: Optional[Tuple[int, int]] = None
+
+    async def load_model(self):
+        """Prepare the backend for inference"""
+        raise NotImplementedError
+
+    async def analyze_screenshot(self, image: Image.Image, max_new_tokens: Optional[int] = None,
+                                 digest: Optional[str] = None) -> Dict[str, Any]:
+        """Analyze a screenshot and return understanding (digest is the frame_digest, if the caller has it)"""
+        raise NotImplementedError
+
+    async def analyze_batch(self, images: List[Image.Image], max_new_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Analyze several images; backends without batched inference run them concurrently"""
+        return list(await asyncio.gather(*(self.analyze_screenshot(image, max_new_tokens) for image in images)))
+
+    async def ask_about_frame(self, digest: str, question: str, max_new_tokens: Optional[int] = None) -> Optional[str]:
+        """Answer a text-only question about an already analyzed frame; None if unsupported"""
+        return None
+
+    async def close(self):
+        """Release backend resources"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get backend statistics"""
+        return {"backend": self.name}
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by this backend in the API process"""
+        return {"context_buffer": deep_sizeof(self.context_buffer)}
+
+    def set_memory_pressure(self, level: int):
+        """Shed memory under pressure (0 normal, 1 soft, 2 hard)"""
+        if level:
+            # Context summaries only look at the last few analyses
+            while len(self.context_buffer) > 3:
+                self.context_buffer.popleft()
+
+    def _record_context(self, analysis: Dict[str, Any]):
+        """Add an analysis to the context buffer"""
+        self.context_buffer.append({
+            'timestamp': time.time(),
+            'analysis': analysis
+        })
+
+    def analyze_heuristic(self, hint: Optional[str]) -> Dict[str, Any]:
+        """Cheap analysis from a text hint (e.g. the active window title) without running the model"""
+        analysis = {
+            'description': f"User is in {hint}" if hint else "User activity unknown"
+        }
+        analysis.update(self.classifier.classify(hint or ""))
+        analysis['inference_time'] = 0.0
+        analysis['heuristic'] = True
+
+        self._record_context(analysis)
+
+        return analysis
+
+    def _mock_analysis(self, image: Image.Image, error: Optional[str] = None) -> Dict[str, Any]:
+        """Mock analysis for development without model, or in place of a failed one
+
+        Marked with mock=True (and the failure in error) so callers can tell it
+        apart from a real analysis.
+        """
+        activities = [
+            {
+                'description': 'User is coding in VSCode, working on a Python file',
+                'application': 'VSCode',
+                'activity': 'coding',
+                'user_state': 'focused',
+                'notable_elements': ['code', 'python'],
+                'relevance_score': 0.6
+            },
+            {
+                'description': 'User is browsing Reddit, looking at memes',
+                'application': 'Browser',
+                'activity': 'browsing',
+                'user_state': 'casual',
+                'notable_elements': ['reddit', 'memes'],
+                'relevance_score': 0.4
+            },
+            {
+                'description': 'User encountered an error in their code',
+                'application': 'IDE',
+                'activity': 'coding',
+                'user_state': 'struggling',
+                'notable_elements': ['error', 'debugging'],
+                'relevance_score': 0.9
+            }
+        ]
+
+        analysis = random.choice(activities)
+        analysis['inference_time'] = random.uniform(0.3, 0.5)
+        analysis['mock'] = True
+        if error:
+            analysis['error'] = error
+
+        return analysis
+
+    def get_context_summary(self) -> str:
+        """Get a summary of recent context"""
+        if not self.context_buffer:
+            return "No recent activity"
+
+        # Get last few activities
+        recent = list(self.context_buffer)[-3:]
+        activities = [item['analysis']['activity'] for item in recent]
+
+        # Create summary
+        if len(set(activities)) == 1:
+            return f"User has been {activities[0]} for a while"
+        else:
+            return f"User switched from {activities[0]} to {activities[-1]}"
+
+
+class StubVisionBackend(VisionBackend):
+    """Stand-in backend for tests and load tests: mock analyses with an optional artificial delay"""
+
+    name = "mock"
+
+    def __init__(self, latency: Optional[float] = None):
+        super().__init__()
+        self.latency = settings.mock_vision_latency if latency is None else latency
+
+    async def load_model(self):
+        self.is_loaded = True
+
+    async def analyze_screenshot(self, image: Image.Image, max_new_tokens: Optional[int] = None,
+                                 digest: Optional[str] = None) -> Dict[str, Any]:
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+        analysis = self._mock_analysis(image)
+        analysis['image_size'] = list(image.size)
+        return analysis
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """Parse "unix:/path/to.sock" or "host:port" into ("unix", path) or ("tcp", (host, port))"""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid inference server address {address!r}, expected unix:/path or host:port")
+    return "tcp", (host, int(port))
+
+
+class ServerError(Exception):
+    """Error response from the inference server"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class ConnectionPool:
+    """Small pool of persistent HTTP/1.1 keep-alive connections to the inference server"""
+
+    def __init__(self, address: str, size: int):
+        self.kind, self.target = parse_address(address)
+        self.size = max(1, size)
+        self._idle: deque = deque()
+        self._slots = asyncio.Semaphore(self.size)
+        self.opened = 0
+        self.reused = 0
+
+    async def _open(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        self.opened += 1
+        if self.kind == "unix":
+            return await asyncio.open_unix_connection(self.target)
+        return await asyncio.open_connection(*self.target)
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: Optional[Dict[str, str]] = None,
+                      timeout: float = 30.0) -> Tuple[int, bytes]:
+        """Send one request on a pooled connection; retries once on a stale connection"""
+        async with self._slots:
+            for attempt in range(2):
+                reused = bool(self._idle)
+                reader, writer = self._idle.popleft() if reused else await self._open()
+                if reused:
+                    self.reused += 1
+                try:
+                    status, payload, keep_alive = await asyncio.wait_for(
+                        self._exchange(reader, writer, method, path, body, headers or {}), timeout=timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    writer.close()
+                    # A kept-alive connection may have been closed by the server; retry on a fresh one
+                    if reused and attempt == 0:
+                        continue
+                    raise ConnectionError(f"Inference server connection failed: {e}") from e
+                except BaseException:
+                    writer.close()
+                    raise
+
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, payload
+
+    @staticmethod
+    async def _exchange(reader, writer, method: str, path: str, body: bytes,
+                        headers: Dict[str, str]) -> Tuple[int, bytes, bool]:
+        lines = [f"{method} {path} HTTP/1.1", "Host: vision", f"Content-Length: {len(body)}"]
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split(b" ", 2)[1])
+        response_headers = await read_headers(reader)
+        length = int(response_headers.get("content-length", "0"))
+        payload = await reader.readexactly(length) if length else b""
+        keep_alive = response_headers.get("connection", "keep-alive").lower() != "close"
+        return status, payload, keep_alive
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.popleft()
+            writer.close()
+
+
+async def read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+    """Read HTTP headers up to the blank line, lowercasing names"""
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+class RemoteVisionBackend(VisionBackend):
+    """Vision backend that forwards frames to a local inference server
+
+    Frames are sent as raw pixels over pooled keep-alive connections (Unix
+    socket or TCP), so the API process never loads the model weights and can
+    be restarted independently of the inference server.
+    """
+
+    name = "remote"
+
+    def __init__(self, address: Optional[str] = None):
+        super().__init__()
+        self.address = address or settings.vision_server_address
+        self.pool = ConnectionPool(self.address, settings.vision_server_connections)
+        self.requests = 0
+        self.errors = 0
+        self.server_info: Dict[str, Any] = {}
+        self.last_probe = 0.0
+
+    async def _probe_health(self) -> bool:
+        """Refresh is_loaded and input_size from /health; False if the server did not answer"""
+        self.last_probe = time.monotonic()
+        status, payload = await self.pool.request("GET", "/health", timeout=5)
+        if status != 200:
+            return False
+        self.server_info = json.loads(payload)
+        self.is_loaded = bool(self.server_info.get("model_loaded"))
+        input_size = self.server_info.get("input_size")
+        self.input_size = tuple(input_size) if input_size else None
+        return True
+
+    async def load_model(self):
+        """Wait for the inference server to become healthy
+
+        If it is not up in time, analyses are mocked until a request succeeds;
+        /health is then checked again so is_loaded and input_size catch up.
+        """
+        deadline = time.monotonic() + settings.vision_server_start_timeout
+        last_error = None
+        while True:
+            try:
+                if await self._probe_health():
+                    print(f"Connected to inference server at {self.address} ({self.server_info.get('backend')})")
+                    return
+            except (OSError, asyncio.TimeoutError) as e:
+                last_error = e
+            if time.monotonic() >= deadline:
+                print(f"Inference server at {self.address} not reachable: {last_error or 'unhealthy'}")
+                print("Falling back to mock mode until it comes up")
+                return
+            await asyncio.sleep(1)
+
+    async def analyze_screenshot(self, image: Image.Image, max_new_tokens: Optional[int] = None,
+                                 digest: Optional[str] = None) -> Dict[str, Any]:
+        """Send a frame to the inference server"""
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Image-Mode": image.mode,
+            "X-Image-Size": f"{image.width}x{image.height}",
+        }
+        if max_new_tokens:
+            headers["X-Max-New-Tokens"] = str(max_new_tokens)
+        if digest:
+            headers["X-Frame-Digest"] = digest
+
+        self.requests += 1
+        try:
+            status, payload = await self.pool.request(
+                "POST", "/analyze", body=image.tobytes(), headers=headers, timeout=settings.vision_server_timeout
+            )
+            if status != 200:
+                raise ServerError(status, payload.decode("utf-8", "replace"))
+            analysis = json.loads(payload)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error analyzing screenshot on inference server: {e}")
+            return self._mock_analysis(image, f"inference server: {e}")
+
+        if not self.is_loaded and time.monotonic() - self.last_probe >= HEALTH_REPROBE_INTERVAL:
+            # The server came up after load_model gave up on it, or has loaded its model since
+            try:
+                if await self._probe_health() and self.is_loaded:
+                    print(f"Inference server at {self.address} is ready ({self.server_info.get('backend')})")
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                print(f"Error checking inference server health: {e}")
+
+        self._record_context(analysis)
+        return analysis
+
+    async def close(self):
+        await self.pool.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "address": self.address,
+            "server": self.server_info,
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections_opened": self.pool.opened,
+            "connections_reused": self.pool.reused,
+        }
+
+
+def create_vision_backend(kind: Optional[str] = None) -> VisionBackend:
+    """Build the configured vision backend (local, pool, remote or mock)"""
+    kind = (kind or settings.vision_backend).lower()
+    if kind == "local":
+        from vision import FastVLMVision
+        return FastVLMVision()
+    if kind == "pool":
+        from replicas import ReplicaPool
+        return ReplicaPool()
+    if kind == "remote":
+        return RemoteVisionBackend()
+    if kind == "mock":
+        return StubVisionBackend()
+    raise ValueError(f"Unknown vision backend {kind!r}, expected local, pool, remote or mock")
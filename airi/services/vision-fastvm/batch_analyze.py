@@ -0,0 +1,217 @@
+"""Analyze directories of saved screenshots offline
+
+Usage:
+    python batch_analyze.py ./data/screenshots --output labels.jsonl
+    python batch_analyze.py shots/ more/*.png --output labels.jsonl --batch-size 16 --workers 8
+    python batch_analyze.py ./data/screenshots --output /tmp/dry.jsonl --backend mock
+
+Images are listed lazily (directories are walked in sorted order) and
+decoded in a thread pool a few batches ahead of the model, using the same
+sizing as live capture: fit to max_resolution, then no larger than the
+model's input size. JPEGs are decoded at a reduced DCT scale when the target
+is much smaller. The local backend runs each batch through one generate call;
+the others analyze a batch's images concurrently.
+
+Each result is appended to --output as one JSON line and the file is fsynced
+after every batch. Re-running with the same output skips images that already
+have a result, so an interrupted run resumes where it stopped. A torn last
+line is cut off, and images whose previous attempt failed are retried
+(including ones a backend answered with a mock analysis).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from PIL import Image
+
+from config import settings
+from backends import create_vision_backend
+from capture import cover_scale, fit_scale, resize_frame
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def iter_images(inputs: List[str]) -> Iterator[str]:
+    """Absolute paths of the images given directly or found under the given directories"""
+    for entry in inputs:
+        if os.path.isfile(entry):
+            yield os.path.abspath(entry)
+            continue
+        for root, dirs, files in os.walk(entry):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+def load_image(path: str, input_size: Optional[Tuple[int, int]]) -> Image.Image:
+    """Decode an image and downscale it the way capture prepares a live frame"""
+    with Image.open(path) as img:
+        scale = fit_scale(img.size, settings.max_resolution)
+        if input_size:
+            scale = min(scale, cover_scale(img.size, input_size))
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        # JPEG only: decode at the smallest DCT scale that still covers size
+        img.draft("RGB", size)
+        img = img.convert("RGB")
+    return resize_frame(img, size)
+
+
+def load_done(output: str) -> Set[str]:
+    """Paths that already have a successful result; truncates a torn final line"""
+    done: Set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as f:
+        good = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            good += len(line)
+            if "error" not in record:
+                done.add(record["path"])
+        if good < f.seek(0, os.SEEK_END):
+            print(f"Truncating incomplete record at byte {good} of {output}")
+            f.truncate(good)
+    return done
+
+
+class BulkStats:
+    """Throughput counters for a run"""
+
+    def __init__(self, skipped: int):
+        self.started = time.monotonic()
+        self.skipped = skipped
+        self.analyzed = 0
+        self.errors = 0
+        self.batches = 0
+        self.inference_time = 0.0
+        self.last_report = self.started
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.analyzed / elapsed if elapsed > 0 else 0.0
+
+    def report(self, final: bool = False):
+        elapsed = time.monotonic() - self.started
+        line = (f"{self.analyzed} analyzed, {self.errors} errors, {self.skipped} already done | "
+                f"{self.rate():.2f} images/s over {elapsed:.0f}s")
+        if final and self.batches:
+            line += f" | {self.inference_time / self.batches:.2f}s inference per batch"
+        print(line, flush=True)
+        self.last_report = time.monotonic()
+
+
+def write_records(f, records: List[Dict[str, Any]]):
+    """Append records and make them durable before the next batch starts"""
+    f.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+    f.flush()
+    os.fsync(f.fileno())
+
+
+async def run(args) -> int:
+    backend = create_vision_backend(args.backend)
+    await backend.load_model()
+    if not backend.is_loaded:
+        # analyze_batch would answer with mock analyses, which must not end up in a dataset
+        print("Vision model failed to load, aborting", file=sys.stderr)
+        return 1
+
+    done = load_done(args.output)
+    paths = (path for path in iter_images(args.inputs) if path not in done)
+    stats = BulkStats(len(done))
+    print(f"Analyzing with the {backend.name} backend, batch size {args.batch_size}, "
+          f"{args.workers} decode workers, {len(done)} images already done")
+
+    loop = asyncio.get_running_loop()
+    # PIL releases the GIL while decoding and resampling, so threads are enough
+    decoder = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk-decode")
+    pending: deque = deque()
+
+    def fill():
+        """Keep --prefetch batches of decodes in flight"""
+        while len(pending) < args.batch_size * args.prefetch:
+            path = next(paths, None)
+            if path is None:
+                return
+            pending.append((path, loop.run_in_executor(decoder, load_image, path, backend.input_size)))
+
+    try:
+        with open(args.output, "a", encoding="utf-8") as out:
+            fill()
+            while pending:
+                batch: List[Tuple[str, Image.Image]] = []
+                records: List[Dict[str, Any]] = []
+                while pending and len(batch) < args.batch_size:
+                    path, decoded = pending.popleft()
+                    try:
+                        batch.append((path, await decoded))
+                    except Exception as e:
+                        records.append({"path": path, "error": f"decode: {e}"})
+                        stats.errors += 1
+                    fill()
+
+                if batch:
+                    start = time.monotonic()
+                    try:
+                        analyses = await backend.analyze_batch([img for _, img in batch], args.max_new_tokens)
+                    except Exception as e:
+                        print(f"Error analyzing batch: {e}")
+                        records.extend({"path": path, "error": f"analyze: {e}"} for path, _ in batch)
+                        stats.errors += len(batch)
+                    else:
+                        for (path, img), analysis in zip(batch, analyses):
+                            # The pool and remote backends answer a failed image with a mock analysis
+                            if analysis.get("mock") and backend.name != "mock":
+                                records.append({"path": path, "error": f"analyze: {analysis.get('error', 'mock result')}"})
+                                stats.errors += 1
+                            else:
+                                records.append({"path": path, "image_size": list(img.size), "analysis": analysis})
+                                stats.analyzed += 1
+                    stats.inference_time += time.monotonic() - start
+                    stats.batches += 1
+
+                write_records(out, records)
+                if args.limit and stats.analyzed + stats.errors >= args.limit:
+                    break
+                if time.monotonic() - stats.last_report >= args.report_interval:
+                    stats.report()
+    finally:
+        for _, decoded in pending:
+            decoded.cancel()
+        decoder.shutdown(wait=False, cancel_futures=True)
+        await backend.close()
+
+    stats.report(final=True)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="Image files or directories to walk")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to (resumes if it exists)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per generate call")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Decode/preprocess threads")
+    parser.add_argument("--prefetch", type=int, default=2, help="Batches decoded ahead of the model")
+    parser.add_argument("--backend", default="local", choices=["local", "pool", "remote", "mock"])
+    parser.add_argument("--max-new-tokens", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=0, help="Stop once this many images are done, checked per batch (0 = all)")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+    args.batch_size = max(1, args.batch_size)
+    args.prefetch = max(1, args.prefetch)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
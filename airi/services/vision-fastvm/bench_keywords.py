@@ -0,0 +1,124 @@
+"""Benchmark the keyword classifier against the legacy per-extractor scans
+
+Usage: python bench_keywords.py [--responses 5000] [--extra-terms 0 1000 10000]
+
+Builds a synthetic corpus of model-style screen descriptions and times
+KeywordClassifier.classify against the old approach of lowercasing the
+response once per extractor and running `in` scans over each word list.
+Vocabularies are padded with synthetic application names to show how both
+approaches scale as the vocabularies grow.
+"""
+import argparse
+import copy
+import json
+import random
+import time
+
+from keywords import DEFAULT_VOCAB_PATH, KeywordClassifier
+
+SUBJECTS = ["The user is", "They are", "User is", "Looks like the user is", "The person is"]
+ACTIONS = [
+    "coding in VSCode on a Python file",
+    "debugging a stack trace with an error in the terminal",
+    "watching a YouTube video about cooking",
+    "reading documentation for a web framework in Firefox",
+    "chatting with friends on Discord",
+    "playing a strategy game and just achieved a victory",
+    "browsing Reddit and scrolling through memes",
+    "filling out a form in Chrome",
+    "messaging coworkers in Slack about a new feature",
+    "stuck on a problem in their programming assignment",
+]
+DETAILS = [
+    "A notification popped up in the corner.",
+    "There is a large submit button visible.",
+    "They seem focused and productive.",
+    "The build finished with success.",
+    "Several tabs are open in the browser.",
+    "Nothing unusual stands out on the screen.",
+    "They look like they could use some help.",
+    "It seems like they are learning something interesting.",
+]
+
+
+def build_corpus(size: int, seed: int = 7) -> list:
+    """Generate model-style responses"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        sentence = f"{rng.choice(SUBJECTS)} {rng.choice(ACTIONS)}."
+        details = " ".join(rng.sample(DETAILS, rng.randint(1, 3)))
+        corpus.append(f"{sentence} {details}")
+    return corpus
+
+
+def grow_vocab(vocab: dict, extra_terms: int) -> dict:
+    """Pad the application vocabulary with synthetic names"""
+    grown = copy.deepcopy(vocab)
+    rules = grown["categories"]["application"]["rules"]
+    for i in range(extra_terms):
+        rules.insert(0, {"label": f"App{i}", "terms": [f"synthapp{i}", f"synth app {i}"]})
+    return grown
+
+
+def legacy_classify(text: str, vocab: dict) -> dict:
+    """Reproduction of the original per-extractor substring scans"""
+    result = {}
+    for name, spec in vocab["categories"].items():
+        text_lower = text.lower()
+        if spec.get("mode", "first") == "first":
+            result[name] = spec.get("default")
+            for rule in spec["rules"]:
+                if any(term in text_lower for term in rule["terms"]):
+                    result[name] = rule["label"]
+                    break
+        else:
+            result[name] = [rule["label"] for rule in spec["rules"] if any(term in text_lower for term in rule["terms"])]
+
+    text_lower = text.lower()
+    relevance = vocab["relevance"]
+    score = relevance["base"]
+    for rule in relevance["rules"]:
+        if any(term in text_lower for term in rule["terms"]):
+            score += rule["weight"]
+    result["relevance_score"] = min(relevance["max"], score)
+    return result
+
+
+def time_run(fn, corpus: list) -> float:
+    """Return seconds taken to classify the whole corpus"""
+    start = time.perf_counter()
+    for text in corpus:
+        fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--responses", type=int, default=5000)
+    parser.add_argument("--extra-terms", type=int, nargs="+", default=[0, 1000, 10000])
+    args = parser.parse_args()
+
+    with open(DEFAULT_VOCAB_PATH, "r", encoding="utf-8") as f:
+        base_vocab = json.load(f)
+    corpus = build_corpus(args.responses)
+    avg_len = sum(len(text) for text in corpus) / len(corpus)
+    print(f"Corpus: {len(corpus)} responses, {avg_len:.0f} chars on average")
+    print(f"{'extra terms':>12} {'compile ms':>11} {'legacy us/resp':>15} {'engine us/resp':>15} {'speedup':>8}")
+
+    for extra in args.extra_terms:
+        vocab = grow_vocab(base_vocab, extra)
+
+        start = time.perf_counter()
+        classifier = KeywordClassifier(vocab)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        legacy = time_run(lambda text: legacy_classify(text, vocab), corpus)
+        engine = time_run(classifier.classify, corpus)
+        per_legacy = legacy / len(corpus) * 1e6
+        per_engine = engine / len(corpus) * 1e6
+        print(f"{extra:>12} {compile_ms:>11.1f} {per_legacy:>15.1f} {per_engine:>15.1f} {per_legacy / per_engine:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
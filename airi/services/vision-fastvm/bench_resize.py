@@ -0,0 +1,125 @@
+"""Benchmark the fused capture resize against the legacy two-resample path
+
+Usage: python bench_resize.py [--frames 20] [--input-size 1024] [--filters bilinear lanczos]
+
+Times the per-frame cost of turning a raw BGRA grab into the pixels the
+vision tower consumes, at 1080p, 1440p and 4K:
+
+  legacy  RGB copy via mss's .rgb, LANCZOS fit to max_resolution, privacy
+          filter array round trip, then the processor's BICUBIC resize to the
+          model's shortest edge and center crop
+  fused   BGRX decode straight from the grab buffer, one box-reduce +
+          resample to the model's input size, then the center crop
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import settings
+from capture import RESAMPLE_FILTERS, cover_scale, fit_scale, resize_frame
+
+RESOLUTIONS = [("1080p", (1920, 1080)), ("1440p", (2560, 1440)), ("4K", (3840, 2160))]
+
+
+def synthetic_grab(size: tuple, seed: int = 7) -> bytearray:
+    """Screen-like BGRA buffer: flat panels, gradients and fine text-like noise"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    frame[..., 0] = np.linspace(30, 220, width, dtype=np.uint8)
+    frame[..., 1] = np.linspace(60, 200, height, dtype=np.uint8)[:, None]
+    frame[..., 2] = 245
+    frame[..., 3] = 255
+    for _ in range(40):
+        x, y = rng.integers(0, width - 200), rng.integers(0, height - 100)
+        w, h = rng.integers(100, 200), rng.integers(20, 100)
+        frame[y:y + h, x:x + w, :3] = rng.integers(0, 255, (h, w, 3), dtype=np.uint8) // 64 * 64
+    return bytearray(frame.tobytes())
+
+
+def mss_rgb(raw: bytearray, size: tuple) -> bytes:
+    """What mss's ScreenShot.rgb does to the BGRA buffer"""
+    rgb = bytearray(size[0] * size[1] * 3)
+    rgb[0::3] = raw[2::4]
+    rgb[1::3] = raw[1::4]
+    rgb[2::3] = raw[0::4]
+    return bytes(rgb)
+
+
+def center_crop(img: Image.Image, size: tuple) -> Image.Image:
+    left = (img.width - size[0]) // 2
+    top = (img.height - size[1]) // 2
+    return img.crop((left, top, left + size[0], top + size[1]))
+
+
+def legacy_path(raw: bytearray, size: tuple, input_size: tuple) -> Image.Image:
+    img = Image.frombytes("RGB", size, mss_rgb(raw, size))
+
+    # Old _resize_image
+    max_width, max_height = settings.max_resolution
+    if img.width > max_width or img.height > max_height:
+        aspect = img.width / img.height
+        if img.width > img.height:
+            new_size = (max_width, int(max_width / aspect))
+        else:
+            new_size = (int(max_height * aspect), max_height)
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    # Old _apply_privacy_filters always round-tripped through numpy
+    img = Image.fromarray(np.array(img))
+
+    # HF CLIP-style processor: shortest edge resize, then center crop
+    scale = input_size[0] / min(img.size)
+    img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.BICUBIC)
+    return center_crop(img, input_size)
+
+
+def fused_path(raw: bytearray, size: tuple, input_size: tuple) -> Image.Image:
+    img = Image.frombuffer("RGB", size, raw, "raw", "BGRX", 0, 1)
+
+    # Same sizing as ScreenCapture._prepare_frame for an uncropped frame
+    ref_scale = fit_scale(img.size, settings.max_resolution)
+    reference = (img.width * ref_scale, img.height * ref_scale)
+    scale = min(fit_scale(reference, settings.max_resolution), cover_scale(reference, input_size))
+    target = (max(1, round(reference[0] * scale)), max(1, round(reference[1] * scale)))
+    img = resize_frame(img, target)
+
+    # The processor's resize is skipped (do_resize=False); only its crop remains
+    return center_crop(img, input_size)
+
+
+def time_path(fn, raw: bytearray, size: tuple, input_size: tuple, frames: int) -> float:
+    """Milliseconds per frame"""
+    fn(raw, size, input_size)
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn(raw, size, input_size)
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--input-size", type=int, default=1024, help="Model shortest edge / crop size")
+    parser.add_argument("--filters", nargs="+", default=["bilinear", "lanczos"], choices=sorted(RESAMPLE_FILTERS))
+    args = parser.parse_args()
+
+    input_size = (args.input_size, args.input_size)
+    print(f"Model input {input_size[0]}x{input_size[1]}, max_resolution {settings.max_resolution}, {args.frames} frames")
+    print(f"{'screen':>8} {'legacy ms':>10} " + " ".join(f"{f'fused/{name} ms':>18} {'speedup':>8}" for name in args.filters))
+
+    for label, size in RESOLUTIONS:
+        raw = synthetic_grab(size)
+        legacy = time_path(legacy_path, raw, size, input_size, args.frames)
+        columns = []
+        for name in args.filters:
+            settings.resize_filter = name
+            fused = time_path(fused_path, raw, size, input_size, args.frames)
+            columns.append(f"{fused:>18.1f} {legacy / fused:>7.1f}x")
+        print(f"{label:>8} {legacy:>10.1f} " + " ".join(columns))
+
+
+if __name__ == "__main__":
+    main()
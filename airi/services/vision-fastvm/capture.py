@@ -1,90 +1,291 @@
 import asyncio
 import time
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List, Dict, Any
 from PIL import Image
 import mss
 import numpy as np
 from io import BytesIO
 import platform
 import subprocess
+import hashlib
 
 from config import settings
+from profiling import span
+from memory import FramePool
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+# Box-reduce by an integer factor until the image is within this multiple of the target, then resample
+REDUCING_GAP = 2.0
+
+def fit_scale(size: Tuple[float, float], bound: Tuple[int, int]) -> float:
+    """Largest scale (at most 1) at which size fits within bound"""
+    return min(1.0, bound[0] / size[0], bound[1] / size[1])
+
+def cover_scale(size: Tuple[float, float], target: Tuple[int, int]) -> float:
+    """Smallest scale at which size still covers target (what a shortest-edge processor resizes to)"""
+    return max(target[0] / size[0], target[1] / size[1])
+
+def resize_frame(img: Image.Image, size: Tuple[int, int], box: Optional[Tuple[float, float, float, float]] = None) -> Image.Image:
+    """Crop and downscale in one pass: integer box reduction, then a single resample"""
+    if box is None and tuple(size) == img.size:
+        return img
+    resample = RESAMPLE_FILTERS.get(settings.resize_filter.lower(), Image.Resampling.BILINEAR)
+    return img.resize(size, resample, box=box, reducing_gap=REDUCING_GAP)
+
+def frame_digest(img: Image.Image) -> str:
+    """Content hash of a frame, used to recognise identical captures"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+class MonitorState:
+    """Capture schedule and change detection state for one monitor"""
+    
+    def __init__(self, monitor_id: int, geometry: Dict[str, int]):
+        self.monitor_id = monitor_id
+        self.geometry = geometry
+        self.base_interval = settings.monitor_capture_intervals.get(monitor_id, settings.capture_interval)
+        self.interval = self.base_interval
+        self.next_due = 0.0
+        self.signature: Optional[np.ndarray] = None
+        self.last_change_time = 0.0
+        self.grabs = 0
+        self.changes = 0
+        self.selected = 0
+    
+    def contains(self, x: int, y: int) -> bool:
+        """Check if a screen coordinate lies on this monitor"""
+        g = self.geometry
+        return g["left"] <= x < g["left"] + g["width"] and g["top"] <= y < g["top"] + g["height"]
+    
+    def record_grab(self, signature: np.ndarray, current_time: float, is_active: bool) -> bool:
+        """Update change detection and the next due time; returns True if the monitor changed"""
+        changed = self.signature is None or self.signature.shape != signature.shape or \
+            float(np.abs(self.signature - signature).mean()) > settings.monitor_change_threshold
+        self.signature = signature
+        self.grabs += 1
+        
+        if changed:
+            self.changes += 1
+            self.last_change_time = current_time
+        
+        # Active or changing monitors keep their base rate, idle ones back off
+        if changed or is_active:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.interval * 2, max(self.base_interval, settings.idle_monitor_interval))
+        self.next_due = current_time + self.interval
+        return changed
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-monitor statistics"""
+        return {
+            "monitor_id": self.monitor_id,
+            "size": (self.geometry["width"], self.geometry["height"]),
+            "interval": self.interval,
+            "last_change": self.last_change_time,
+            "grabs": self.grabs,
+            "changes": self.changes,
+            "selected": self.selected
+        }
 
 class ScreenCapture:
     def __init__(self):
-        self.sct = mss.mss()
+        self.sct = self._open_grabber()
         self.last_capture_time = 0
         self.capture_count = 0
         self.is_capturing = False
         self.last_activity_time = time.time()
+        self.monitors = self._init_monitors()
+        self.active_window_title: Optional[str] = None
+        # Adjusted at runtime by the quality controller
+        self.max_resolution: Tuple[int, int] = tuple(settings.max_resolution)
+        self.crop_to_focus = False
+        # Vision tower input (width, height), set from the vision backend so frames are resized for it once
+        self.model_input_size: Optional[Tuple[int, int]] = None
+        # Full-resolution grabs are decoded into reused buffers
+        self.frame_pool = FramePool(settings.frame_pool_mb * 1024 * 1024)
+        
+    def _open_grabber(self):
+        """Screen grabber exposing mss's monitors and grab()"""
+        return mss.mss()
+        
+    def _init_monitors(self) -> List[MonitorState]:
+        """Build capture state for the configured monitors (mss index 0 is the virtual union)"""
+        available = range(1, len(self.sct.monitors))
+        wanted = settings.capture_monitors or list(available)
+        monitors = [MonitorState(i, self.sct.monitors[i]) for i in wanted if i in available]
+        if not monitors:
+            print(f"None of the configured monitors {wanted} exist, falling back to the primary monitor")
+            monitors = [MonitorState(1, self.sct.monitors[1])]
+        return monitors
+        
+    async def capture_screen(self, force: bool = False) -> Optional[Image.Image]:
+        """Capture the highest-priority monitor that is due (force captures the active monitor now)
         
-    async def capture_screen(self) -> Optional[Image.Image]:
-        """Capture the current screen"""
+        The returned image carries the source monitor in img.info["monitor_id"].
+        """
         try:
-            # Check capture interval
             current_time = time.time()
-            if current_time - self.last_capture_time < settings.capture_interval:
-                return None
-                
-            # Get primary monitor
-            monitor = self.sct.monitors[1]  # Primary monitor
+            active = self._get_active_monitor()
             
-            # Check for privacy zones
-            if self._is_private_app_active():
-                return None
-                
-            # Capture screen
-            screenshot = self.sct.grab(monitor)
-            
-            # Convert to PIL Image
-            img = Image.frombytes(
-                'RGB',
-                (screenshot.width, screenshot.height),
-                screenshot.rgb
-            )
-            
-            # Resize if needed
-            img = self._resize_image(img)
-            
-            # Apply privacy filters
-            img = self._apply_privacy_filters(img)
+            if force:
+                due = [active]
+            else:
+                due = [m for m in self.monitors if current_time >= m.next_due]
+                if not due:
+                    return None
             
-            self.last_capture_time = current_time
-            self.capture_count += 1
+            # Check for privacy zones
+            with span("capture.window_check"):
+                if self._is_private_app_active():
+                    return None
             
-            return img
+            # Grab every due monitor for change detection, then pick one for inference:
+            # the active monitor if it changed, else the most recently changed one,
+            # else the active monitor if it was due anyway
+            changed = []
+            frames = {}
+            try:
+                for monitor in due:
+                    with span("capture.grab"):
+                        raw = self._grab(monitor)
+                    frames[monitor.monitor_id] = raw
+                    with span("capture.change_detect"):
+                        if monitor.record_grab(self._signature(raw), current_time, monitor is active):
+                            changed.append(monitor)
+                
+                if active in changed or (force and active in due):
+                    chosen = active
+                elif changed:
+                    chosen = max(changed, key=lambda m: m.last_change_time)
+                elif active in due:
+                    chosen = active
+                else:
+                    return None
+                
+                # Crop and resize once to the processing size, then apply privacy filters
+                img = self._prepare_frame(frames[chosen.monitor_id], chosen)
+                img.info["monitor_id"] = chosen.monitor_id
+                
+                chosen.selected += 1
+                self.last_capture_time = current_time
+                self.capture_count += 1
+                
+                return img
+            finally:
+                # The chosen frame was resized into a new image; grab buffers go back to the pool
+                for raw in frames.values():
+                    self.frame_pool.release(raw)
             
         except Exception as e:
             print(f"Error capturing screen: {e}")
             return None
     
-    def _resize_image(self, img: Image.Image) -> Image.Image:
-        """Resize image if it exceeds max resolution"""
-        max_width, max_height = settings.max_resolution
-        
-        if img.width > max_width or img.height > max_height:
-            # Calculate aspect ratio
-            aspect = img.width / img.height
-            
-            if img.width > img.height:
-                new_width = max_width
-                new_height = int(max_width / aspect)
-            else:
-                new_height = max_height
-                new_width = int(max_height * aspect)
-                
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
+    def _grab(self, monitor: MonitorState) -> Image.Image:
+        """Grab one monitor as a PIL image"""
+        screenshot = self.sct.grab(monitor.geometry)
+        # Decode mss's BGRA buffer straight into a pooled image instead of building an RGB copy
+        # through screenshot.rgb and allocating a new frame
+        img = self.frame_pool.acquire('RGB', (screenshot.width, screenshot.height))
+        img.frombytes(screenshot.raw, 'raw', 'BGRX')
         return img
     
-    def _apply_privacy_filters(self, img: Image.Image) -> Image.Image:
-        """Apply privacy filters to sensitive regions"""
+    def _signature(self, img: Image.Image) -> np.ndarray:
+        """Small grayscale thumbnail used for cheap change detection"""
+        factor = max(1, img.width // 64)
+        return np.asarray(img.reduce(factor).convert('L'), dtype=np.int16)
+    
+    def _get_active_monitor(self) -> MonitorState:
+        """Monitor under the mouse cursor, used as a proxy for the active window"""
+        if len(self.monitors) > 1:
+            try:
+                import pyautogui
+                x, y = pyautogui.position()
+                for monitor in self.monitors:
+                    if monitor.contains(x, y):
+                        return monitor
+            except Exception:
+                pass
+        return self.monitors[0]
+    
+    def _prepare_frame(self, img: Image.Image, monitor: MonitorState) -> Image.Image:
+        """Crop and downscale a raw grab in a single resample, then blur privacy zones
+        
+        Privacy zones and the focus crop are defined on the frame scaled to fit
+        settings.max_resolution (the reference frame). The output also fits the
+        quality level's max_resolution and, when the model's input size is
+        known, is no larger than what its processor would shrink it to, so the
+        processor does not have to resample it again.
+        """
+        ref_scale = fit_scale(img.size, settings.max_resolution)
+        reference = (img.width * ref_scale, img.height * ref_scale)
+        left, top, right, bottom = self._focus_box(reference, monitor) if self.crop_to_focus else \
+            (0.0, 0.0, reference[0], reference[1])
+        region = (right - left, bottom - top)
+        
+        # Scale from reference coordinates to output pixels
+        scale = fit_scale(region, self.max_resolution)
+        if self.model_input_size:
+            scale = min(scale, cover_scale(region, self.model_input_size))
+        size = (max(1, round(region[0] * scale)), max(1, round(region[1] * scale)))
+        
+        cropped = self.crop_to_focus and region != reference
+        box = (left / ref_scale, top / ref_scale, right / ref_scale, bottom / ref_scale) if cropped else None
+        with span("capture.resize"):
+            source = img
+            img = resize_frame(img, size, box)
+            if img is source:
+                # Already the right size; copy it out of the pooled grab buffer
+                img = img.copy()
+        
+        with span("capture.privacy_filters"):
+            return self._apply_privacy_filters(img, monitor.monitor_id, scale, (-left * scale, -top * scale))
+    
+    def _focus_box(self, reference: Tuple[float, float], monitor: MonitorState) -> Tuple[float, float, float, float]:
+        """A max_resolution-sized box around the cursor, in reference frame coordinates"""
+        crop_width = min(reference[0], self.max_resolution[0])
+        crop_height = min(reference[1], self.max_resolution[1])
+        
+        try:
+            import pyautogui
+            x, y = pyautogui.position()
+            # Cursor is in desktop coordinates; the reference frame is scaled relative to the monitor
+            scale = reference[0] / monitor.geometry["width"]
+            cx = (x - monitor.geometry["left"]) * scale
+            cy = (y - monitor.geometry["top"]) * scale
+        except Exception:
+            cx, cy = reference[0] / 2, reference[1] / 2
+        
+        left = min(max(cx - crop_width / 2, 0), reference[0] - crop_width)
+        top = min(max(cy - crop_height / 2, 0), reference[1] - crop_height)
+        return (left, top, left + crop_width, top + crop_height)
+    
+    def _apply_privacy_filters(self, img: Image.Image, monitor_id: int = 1, scale: float = 1.0,
+                               offset: Tuple[float, float] = (0.0, 0.0)) -> Image.Image:
+        """Apply privacy filters to sensitive regions
+        
+        Zone coordinates are in the reference frame; scale and offset map them onto img.
+        """
+        # Zones without a monitor apply to all
+        zones = [zone for zone in settings.privacy_zones if zone.get('monitor', monitor_id) == monitor_id]
+        if not zones:
+            return img
+        
         # Convert to numpy array for processing
         img_array = np.array(img)
         
         # Apply privacy zones (blur regions)
-        for zone in settings.privacy_zones:
-            x1, y1, x2, y2 = zone.get('coords', [0, 0, 0, 0])
+        for zone in zones:
+            coords = zone.get('coords', [0, 0, 0, 0])
+            x1, x2 = (min(max(round(x * scale + offset[0]), 0), img.width) for x in (coords[0], coords[2]))
+            y1, y2 = (min(max(round(y * scale + offset[1]), 0), img.height) for y in (coords[1], coords[3]))
             if x2 > x1 and y2 > y1:
                 # Simple blur by downsampling and upsampling
                 region = img_array[y1:y2, x1:x2]
@@ -101,6 +302,7 @@ class ScreenCapture:
         """Check if a blacklisted app is currently active"""
         try:
             active_window = self._get_active_window_title()
+            self.active_window_title = active_window
             if active_window:
                 for app in settings.blacklisted_apps:
                     if app.lower() in active_window.lower():
@@ -201,5 +403,16 @@ class ScreenCapture:
             "capture_count": self.capture_count,
             "last_capture": self.last_capture_time,
             "is_capturing": self.is_capturing,
-            "user_state": self.detect_user_state()
-        }
\ No newline at end of file
+            "user_state": self.detect_user_state(),
+            "monitors": [m.get_stats() for m in self.monitors]
+        }
+
+def create_screen_capture() -> ScreenCapture:
+    """Build the configured screen capture (screen or synthetic)"""
+    kind = settings.capture_backend.lower()
+    if kind == "screen":
+        return ScreenCapture()
+    if kind == "synthetic":
+        from synthetic_capture import SyntheticScreenCapture
+        return SyntheticScreenCapture()
+    raise ValueError(f"Unknown capture backend {kind!r}, expected screen or synthetic")
\ No newline at end of file
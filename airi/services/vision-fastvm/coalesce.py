@@ -0,0 +1,67 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution
+
+    While a call for a key is in flight, later callers await the same task
+    instead of starting their own. A successful result is also kept for `ttl`
+    seconds after it finishes so requests arriving just afterwards reuse it.
+    Failures are shared with the callers already waiting but never cached.
+    """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self.calls = 0
+        self.executions = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn for key, or join/reuse an identical call"""
+        self.calls += 1
+        current_time = time.monotonic()
+        self._prune(current_time)
+
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached[1]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+
+        # Shield so a cancelled waiter (e.g. a dropped websocket) doesn't cancel the shared work
+        return await asyncio.shield(task)
+
+    def remember(self, key: Hashable, result: Any):
+        """Store a result computed elsewhere so callers within ttl reuse it"""
+        if self.ttl > 0:
+            self._results[key] = (time.monotonic(), result)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        """Move a finished task's result into the reuse cache"""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.remember(key, task.result())
+
+    def _prune(self, current_time: float):
+        """Drop results older than ttl"""
+        expired = [key for key, (finished, _) in self._results.items() if current_time - finished > self.ttl]
+        for key in expired:
+            del self._results[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics"""
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.calls - self.executions,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,183 @@
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+DEFAULT_TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "comments.json")
+
+# Mood used when a requested mood has no modifier entry
+NEUTRAL_MOOD = ""
+
+
+class CommentTemplates:
+    """Comment templates compiled into (activity, state, mood) lookups
+
+    Templates and mood modifiers are loaded from a JSON table, validated and
+    pre-rendered for every mood once, so picking a comment is a dict lookup
+    plus a random index no matter how large the template set grows. The file
+    is re-checked at most every `reload_interval` seconds and recompiled when
+    it changes; a table that fails validation is reported and the previous
+    one stays active.
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: Optional[float] = None):
+        self.path = path or settings.comment_templates_path or DEFAULT_TEMPLATES_PATH
+        self.reload_interval = settings.comment_templates_reload_interval if reload_interval is None else reload_interval
+        self.version = None
+        self.reload_count = 0
+        self._file_signature = None
+        self._last_check = 0.0
+        # Initial load errors propagate; there is no previous table to fall back to
+        self._load()
+
+    def _read_signature(self) -> Tuple[int, int]:
+        """Return (mtime_ns, size) used to detect file changes"""
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """Read, validate and compile the template file"""
+        signature = self._read_signature()
+        with open(self.path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        self._compile(table)
+        self._file_signature = signature
+
+    def maybe_reload(self) -> bool:
+        """Recompile the table if the file changed since the last check"""
+        current_time = time.monotonic()
+        if current_time - self._last_check < self.reload_interval:
+            return False
+        self._last_check = current_time
+
+        try:
+            if self._read_signature() == self._file_signature:
+                return False
+            self._load()
+            self.reload_count += 1
+            print(f"Reloaded comment templates from {self.path} (version {self.version})")
+            return True
+        except Exception as e:
+            print(f"Error reloading comment templates, keeping previous table: {e}")
+            return False
+
+    @staticmethod
+    def _validate(table: Dict[str, Any]):
+        """Raise ValueError if the table does not match the expected schema"""
+        def check_comments(value: Any, where: str):
+            if not isinstance(value, list) or not value:
+                raise ValueError(f"{where} must be a non-empty list of strings")
+            for comment in value:
+                if not isinstance(comment, str) or not comment.strip():
+                    raise ValueError(f"{where} contains an empty or non-string comment: {comment!r}")
+
+        if not isinstance(table, dict):
+            raise ValueError("Comment table must be a JSON object")
+
+        check_comments(table.get("fallback"), "fallback")
+        if not isinstance(table.get("default_comment"), str):
+            raise ValueError("default_comment must be a string")
+
+        activities = table.get("activities")
+        if not isinstance(activities, dict):
+            raise ValueError("activities must be an object of activity -> state -> comments")
+        for activity, states in activities.items():
+            if not isinstance(states, dict):
+                raise ValueError(f"activities.{activity} must be an object of state -> comments")
+            for state, comments in states.items():
+                check_comments(comments, f"activities.{activity}.{state}")
+
+        triggers = table.get("description_triggers", [])
+        if not isinstance(triggers, list):
+            raise ValueError("description_triggers must be a list")
+        for i, trigger in enumerate(triggers):
+            keywords = trigger.get("keywords") if isinstance(trigger, dict) else None
+            if not isinstance(keywords, list) or not keywords or not all(isinstance(k, str) and k for k in keywords):
+                raise ValueError(f"description_triggers[{i}].keywords must be a non-empty list of strings")
+            check_comments(trigger.get("comments"), f"description_triggers[{i}].comments")
+
+        moods = table.get("moods")
+        if not isinstance(moods, dict):
+            raise ValueError("moods must be an object of mood -> modifier")
+        for mood, modifier in moods.items():
+            if not isinstance(modifier, dict) or set(modifier) - {"prefix", "suffix"}:
+                raise ValueError(f"moods.{mood} may only define 'prefix' and 'suffix'")
+            if not all(isinstance(v, str) for v in modifier.values()):
+                raise ValueError(f"moods.{mood} prefix/suffix must be strings")
+
+    def _compile(self, table: Dict[str, Any]):
+        """Pre-render every template for every mood into indexed lookups"""
+        self._validate(table)
+
+        modifiers = {mood: (m.get("prefix", ""), m.get("suffix", "")) for mood, m in table["moods"].items()}
+        modifiers.setdefault(NEUTRAL_MOOD, ("", ""))
+
+        def render(comments: List[str]) -> Dict[str, Tuple[str, ...]]:
+            return {mood: tuple(prefix + c + suffix for c in comments) for mood, (prefix, suffix) in modifiers.items()}
+
+        by_key: Dict[Tuple[str, str, str], Tuple[str, ...]] = {}
+        for activity, states in table["activities"].items():
+            for state, comments in states.items():
+                for mood, rendered in render(comments).items():
+                    by_key[(activity, state, mood)] = rendered
+
+        triggers = [
+            (tuple(k.lower() for k in trigger["keywords"]), render(trigger["comments"]))
+            for trigger in table.get("description_triggers", [])
+        ]
+
+        # Swap everything in at once so readers never see a half-built table
+        self._modifiers = modifiers
+        self._by_key = by_key
+        self._fallback = render(table["fallback"])
+        self._triggers = triggers
+        self._default = {mood: prefix + table["default_comment"] + suffix for mood, (prefix, suffix) in modifiers.items()}
+        self.version = table.get("version")
+
+    def apply_mood(self, comment: str, mood: str) -> str:
+        """Apply a mood's prefix and suffix to an arbitrary comment"""
+        prefix, suffix = self._modifiers.get(mood, self._modifiers[NEUTRAL_MOOD])
+        return prefix + comment + suffix
+
+    def state_comments(self, activity: str, user_state: str, mood: str) -> Tuple[str, ...]:
+        """Mood-rendered comments for an activity/state, or the fallback set"""
+        if mood not in self._modifiers:
+            mood = NEUTRAL_MOOD
+        comments = self._by_key.get((activity, user_state, mood))
+        return comments if comments is not None else self._fallback[mood]
+
+    def trigger_comments(self, description: str, mood: str) -> Tuple[str, ...]:
+        """Mood-rendered comments for the first description trigger that matches"""
+        if not self._triggers or not description:
+            return ()
+        if mood not in self._modifiers:
+            mood = NEUTRAL_MOOD
+        description = description.lower()
+        for keywords, rendered in self._triggers:
+            if any(keyword in description for keyword in keywords):
+                return rendered[mood]
+        return ()
+
+    def pick(self, activity: str, user_state: str, description: str, mood: str) -> str:
+        """Pick a mood-rendered comment for the given context"""
+        self.maybe_reload()
+        base = self.state_comments(activity, user_state, mood)
+        extra = self.trigger_comments(description, mood)
+
+        total = len(base) + len(extra)
+        if not total:
+            return self._default.get(mood, self._default[NEUTRAL_MOOD])
+        i = random.randrange(total)
+        return base[i] if i < len(base) else extra[i - len(base)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get template table statistics"""
+        return {
+            "path": self.path,
+            "version": self.version,
+            "reload_count": self.reload_count,
+            "indexed_keys": len(self._by_key),
+        }
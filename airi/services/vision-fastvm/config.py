@@ -7,17 +7,29 @@ class Settings(BaseSettings):
     model_name: str = "apple/FastVLM-7B"
     device: str = "cuda" if os.environ.get("CUDA_VISIBLE_DEVICES") else "mps" if os.uname().sysname == "Darwin" else "cpu"
     dtype: str = "float16"  # Use float16 for faster inference
+    structured_output: bool = True  # Ask for a compact one-line schema instead of a paragraph
+    structured_max_new_tokens: int = 32  # Token cap for the structured schema
+    model_snapshot: bool = True  # Keep a memory-mappable converted model in cache_dir for fast restarts (pages shared across processes on cpu only; mps copies to the device)
+    feature_cache_mb: int = 256  # Encoded image features kept per frame for reuse (0 = disabled)
     
     # Screen capture settings
+    capture_backend: str = "screen"  # screen (mss) or synthetic (generated frames, no display; used by loadtest.py)
     capture_interval: float = 1.0  # Capture every 1 second
     capture_quality: int = 85  # JPEG quality for captures
     max_resolution: tuple[int, int] = (1920, 1080)  # Max resolution to process
+    resize_filter: str = "bilinear"  # Resample filter after integer box reduction (nearest, bilinear, bicubic, lanczos)
+    capture_monitors: list[int] = [1]  # Monitors to capture (1 = primary); empty list captures all
+    monitor_capture_intervals: dict[int, float] = {}  # Per-monitor interval overrides in seconds
+    idle_monitor_interval: float = 5.0  # Unchanged inactive monitors back off up to this interval
+    monitor_change_threshold: float = 2.0  # Mean thumbnail pixel difference (0-255) that counts as a change
     
     # Engagement settings
     min_time_between_comments: int = 60  # Minimum 60 seconds between comments
     max_comments_per_hour: int = 20
     relevance_threshold: float = 0.7
     focus_detection_minutes: int = 10  # Minutes without activity = focus mode
+    struggle_offer_help_after: int = 300  # Seconds of struggling before offering help
+    comment_templates_reload_interval: float = 2.0  # Seconds between template file change checks
     
     # Privacy settings
     privacy_zones: list[dict] = []  # Regions to exclude from capture
@@ -39,15 +51,71 @@ class Settings(BaseSettings):
     # WebSocket settings
     ws_heartbeat_interval: int = 30  # Seconds
     ws_max_connections: int = 10
+    ws_queue_size: int = 64  # Messages queued per client; broadcasts to a client this far behind are dropped
+    ws_send_timeout: float = 10.0  # A client that takes longer than this to accept one message is disconnected
     
     # Performance settings
     max_context_buffer: int = 10  # Keep last 10 captures in memory
     batch_size: int = 1  # Process one image at a time for real-time
-    num_workers: int = 2
+    num_workers: int = 2  # Model replicas for the pool backend
+    replica_threads: int = 0  # Torch threads per replica (0 = cpu_count // num_workers)
+    replica_health_interval: float = 10.0  # Seconds between replica health checks
+    replica_request_timeout: float = 120.0  # A replica stuck on one request this long is restarted
+    replica_start_timeout: float = 600.0  # Seconds allowed for a replica to load its model
+    replica_max_errors: int = 3  # A replica failing this many requests in a row is restarted
+    analysis_reuse_seconds: float = 2.0  # Reuse an analysis of an identical frame for this long
+    manual_capture_coalesce_window: float = 0.5  # Concurrent manual captures within this window share one result
+    
+    # Pipeline settings (queue policies: block, drop or coalesce)
+    analyze_queue_size: int = 1  # Captured frames waiting for analysis
+    analyze_queue_policy: str = "coalesce"  # A new frame replaces one still waiting, so analysis sees the latest
+    analyze_concurrency: int = 1  # Frames analyzed at once (raise for the pool or remote backends)
+    engage_queue_size: int = 4
+    engage_queue_policy: str = "block"
+    broadcast_queue_size: int = 16  # Comments waiting to be sent to clients
+    broadcast_queue_policy: str = "drop"  # Dropped comments don't count against the engagement rate limit
+    broadcast_concurrency: int = 1
+    
+    # Memory settings
+    memory_budget_mb: int = 0  # RSS budget for this process; caches and quality are shed near it (0 = unlimited)
+    memory_soft_limit: float = 0.85  # Fraction of the budget at which caches are shed
+    memory_check_interval: float = 2.0  # Seconds between RSS checks
+    frame_pool_mb: int = 64  # Reused full-resolution grab buffers (0 = allocate per frame)
+    
+    # Screenshot archive settings (debugging / dataset collection)
+    archive_screenshots: bool = False
+    archive_format: str = "jpeg"  # jpeg or webp, encoded at capture_quality
+    archive_workers: int = 2  # Encoder threads
+    archive_queue_size: int = 8  # Frames waiting to be archived; extra frames are dropped
+    archive_batch_size: int = 4  # Frames written per batch
+    archive_max_mb: int = 1024  # Oldest files are deleted beyond this size (0 = unlimited)
+    archive_max_age_hours: float = 24.0  # Files older than this are deleted (0 = keep forever)
+    
+    # Vision backend settings
+    vision_backend: str = "local"  # local (in-process), pool (replica processes), remote (inference server) or mock
+    mock_vision_latency: float = 0.0  # Artificial seconds per analysis for the mock backend
+    vision_server_address: str = "unix:./cache/vision.sock"  # unix:/path or host:port of inference_server.py
+    vision_server_connections: int = 4  # Pooled keep-alive connections to the inference server
+    vision_server_timeout: float = 120.0  # Seconds to wait for one remote analysis
+    vision_server_start_timeout: float = 30.0  # Seconds to wait for the server to become healthy at startup
+    
+    # Adaptive quality settings
+    adaptive_quality: bool = True  # Run the model on fewer frames (heuristics in between) when latency is over target
+    latency_target: float = 2.0  # Target end-to-end seconds per frame (p90)
+    latency_window: int = 8  # Frames measured before each quality decision
+    latency_headroom: float = 0.6  # Step quality back up when p90 < target * headroom
+    latency_upgrade_cooldown: float = 30.0  # Minimum seconds at a level before stepping back up
+    
+    # Debug settings
+    debug_endpoints: bool = False  # Expose /debug/* admin endpoints (profiling)
+    profile_max_seconds: float = 60.0  # Longest profile /debug/profile will record
+    profile_sample_interval: float = 0.005  # Seconds between stack samples in sample mode
     
     # Paths
     cache_dir: str = "./cache"
     screenshot_dir: str = "./screenshots"
+    keyword_vocab_path: Optional[str] = None  # Defaults to the bundled data/keywords.json
+    comment_templates_path: Optional[str] = None  # Defaults to the bundled data/comments.json
     
     class Config:
         env_file = ".env"
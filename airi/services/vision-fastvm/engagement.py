@@ -5,6 +5,8 @@ from datetime import datetime, timedelta
 import random
 
 from config import settings
+from comment_templates import CommentTemplates
+from profiling import traced
 
 class EngagementEngine:
     def __init__(self):
@@ -14,7 +16,9 @@ class EngagementEngine:
         self.last_user_state = "casual"
         self.focus_start_time = None
         self.struggle_start_time = None
+        self.comment_templates = CommentTemplates()
         
+    @traced("engagement.should_engage")
     def should_engage(self, analysis: Dict[str, Any], user_state: str) -> bool:
         """Determine if should make a comment"""
         current_time = time.time()
@@ -84,9 +88,7 @@ class EngagementEngine:
             return False
         
         struggle_duration = time.time() - self.struggle_start_time
-        return struggle_duration > settings.struggl
-
-_offer_help_after
+        return struggle_duration > settings.struggle_offer_help_after
     
     def _should_engage_with_activity(self, analysis: Dict[str, Any]) -> bool:
         """Activity-specific engagement logic"""
@@ -113,111 +115,16 @@ _offer_help_after
         
         return False
     
+    @traced("engagement.generate_comment")
     def generate_comment(self, analysis: Dict[str, Any], personality_mood: str = "cheerful") -> str:
         """Generate an appropriate comment based on analysis"""
         activity = analysis.get('activity', 'browsing')
         user_state = analysis.get('user_state', 'casual')
         description = analysis.get('description', '')
         
-        # Activity-specific comments
-        comments = self._get_activity_comments(activity, user_state, personality_mood)
-        
-        # Add context from description
-        if 'error' in description.lower():
-            comments.extend([
-                "Oof, that error looks annoying",
-                "Need help with that?",
-                "Debugging time I see..."
-            ])
-        elif 'success' in description.lower() or 'working' in description.lower():
-            comments.extend([
-                "Nice! You got it working!",
-                "Look at you go!",
-                "That's what I'm talking about!"
-            ])
-        
-        # Select comment based on mood
-        comment = random.choice(comments) if comments else "Watching you work is interesting"
-        
-        # Add mood modifiers
-        comment = self._apply_mood_modifiers(comment, personality_mood)
-        
-        return comment
-    
-    def _get_activity_comments(self, activity: str, user_state: str, mood: str) -> List[str]:
-        """Get activity-specific comments"""
-        comments_map = {
-            'gaming': {
-                'celebrating': [
-                    "YESSS! That was amazing!",
-                    "You crushed it!",
-                    "GG! That was sick!"
-                ],
-                'struggling': [
-                    "This part is tough...",
-                    "You've got this!",
-                    "Almost had it!"
-                ],
-                'casual': [
-                    "This game looks fun",
-                    "Nice moves!",
-                    "You're getting better at this"
-                ]
-            },
-            'coding': {
-                'focused': [
-                    "You're in the zone!",
-                    "Look at you being all productive",
-                    "That's some clean code"
-                ],
-                'struggling': [
-                    "Debugging can be so frustrating",
-                    "Want fresh eyes on that?",
-                    "Maybe try a different approach?"
-                ],
-                'celebrating': [
-                    "Finally! It works!",
-                    "That's a clever solution",
-                    "You figured it out!"
-                ]
-            },
-            'browsing': {
-                'casual': [
-                    "That's interesting!",
-                    "Oh what's this?",
-                    "Found something cool?"
-                ]
-            }
-        }
-        
-        activity_comments = comments_map.get(activity, {})
-        state_comments = activity_comments.get(user_state, [])
-        
-        if not state_comments:
-            # Fallback comments
-            return [
-                "What are you up to?",
-                "Looks interesting",
-                "I'm here watching with you"
-            ]
-        
-        return state_comments
-    
-    def _apply_mood_modifiers(self, comment: str, mood: str) -> str:
-        """Apply personality mood modifiers to comment"""
-        mood_modifiers = {
-            'cheerful': lambda c: c + " 😊",
-            'playful': lambda c: c + " hehe",
-            'thoughtful': lambda c: "Hmm... " + c,
-            'excited': lambda c: c + "!!",
-            'affectionate': lambda c: c + " 💕",
-            'curious': lambda c: c + "... tell me more?",
-            'calm': lambda c: c,
-            'sleepy': lambda c: c + " *yawn*"
-        }
-        
-        modifier = mood_modifiers.get(mood, lambda c: c)
-        return modifier(comment)
+        # Activity/state comments plus description-triggered ones, already
+        # rendered for the mood by the compiled template table
+        return self.comment_templates.pick(activity, user_state, description, personality_mood)
     
     def record_engagement(self, timestamp: Optional[float] = None):
         """Record that an engagement happened"""
@@ -261,5 +168,6 @@ _offer_help_after
             'comments_this_hour': len(recent_comments),
             'current_user_state': self.last_user_state,
             'focus_duration': (current_time - self.focus_start_time) if self.focus_start_time else 0,
-            'struggle_duration': (current_time - self.struggle_start_time) if self.struggle_start_time else 0
+            'struggle_duration': (current_time - self.struggle_start_time) if self.struggle_start_time else 0,
+            'templates': self.comment_templates.get_stats()
         }
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""Standalone inference server for the remote vision backend
+
+Usage:
+    python inference_server.py                      # serve FastVLM on VISION_SERVER_ADDRESS
+    python inference_server.py --backend pool       # serve a replica pool instead
+    python inference_server.py --stub               # lightweight stand-in, no model or torch
+
+The API process talks to this server through RemoteVisionBackend, so the
+API can be restarted or upgraded without reloading the model weights.
+
+Protocol (HTTP/1.1 with keep-alive, over a Unix socket or TCP):
+    GET  /health   -> {"status": "ok", "backend": ..., "model_loaded": bool, "input_size": [w, h] | null}
+    POST /analyze  -> analysis JSON; the body is raw pixels described by the
+                      X-Image-Mode and X-Image-Size ("WxH") headers, with
+                      optional X-Max-New-Tokens and X-Frame-Digest (the
+                      caller's frame_digest, reused as the feature cache key)
+                      headers
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+from PIL import Image
+
+from config import settings
+from backends import VisionBackend, StubVisionBackend, create_vision_backend, parse_address, read_headers
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class InferenceServer:
+    """Minimal HTTP/1.1 keep-alive server in front of a vision backend
+
+    Inference runs on a dedicated thread with its own event loop so a long
+    generate call never stalls health checks or request parsing. Requests are
+    handed to the backend as they arrive and the backend sets the concurrency:
+    FastVLMVision serializes generate calls behind its own lock, while a
+    replica pool spreads them over its replicas.
+    """
+
+    def __init__(self, backend: VisionBackend, address: str):
+        self.backend = backend
+        self.address = address
+        self.requests = 0
+        self._inference_loop = asyncio.new_event_loop()
+        threading.Thread(target=self._inference_loop.run_forever, name="inference", daemon=True).start()
+
+    async def _run_inference(self, coro):
+        """Run a backend coroutine on the inference thread"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._inference_loop))
+
+    async def serve(self):
+        """Load the backend and serve until cancelled"""
+        await self._run_inference(self.backend.load_model())
+
+        kind, target = parse_address(self.address)
+        if kind == "unix":
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            if os.path.exists(target):
+                os.remove(target)
+            server = await asyncio.start_unix_server(self._handle_connection, path=target)
+        else:
+            server = await asyncio.start_server(self._handle_connection, *target)
+
+        print(f"Inference server ({self.backend.name}) listening on {self.address}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readuntil(b"\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = await read_headers(reader)
+                length = int(headers.get("content-length", "0"))
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._dispatch(method, path, headers, body)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except Exception as e:
+            print(f"Error on inference connection: {e}")
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+        """Route one request"""
+        if method == "GET" and path == "/health":
+            return 200, {
+                "status": "ok",
+                "backend": self.backend.name,
+                "model_loaded": self.backend.is_loaded,
+                "input_size": self.backend.input_size,
+                "requests": self.requests,
+            }
+
+        if method == "POST" and path == "/analyze":
+            try:
+                width, height = (int(v) for v in headers["x-image-size"].split("x"))
+                image = Image.frombytes(headers.get("x-image-mode", "RGB"), (width, height), body)
+                max_new_tokens = int(headers["x-max-new-tokens"]) if "x-max-new-tokens" in headers else None
+                digest = headers.get("x-frame-digest")
+            except (KeyError, ValueError) as e:
+                return 400, {"error": f"Invalid image payload: {e}"}
+            try:
+                analysis = await self._run_inference(self.backend.analyze_screenshot(
+                    image, max_new_tokens=max_new_tokens, digest=digest
+                ))
+            except Exception as e:
+                return 500, {"error": str(e)}
+            self.requests += 1
+            return 200, analysis
+
+        return 404, {"error": f"No route for {method} {path}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastVLM inference server")
+    parser.add_argument("--address", default=settings.vision_server_address,
+                        help="unix:/path/to.sock or host:port (default: VISION_SERVER_ADDRESS)")
+    parser.add_argument("--backend", choices=["local", "pool"], default="local",
+                        help="Backend that runs the model inside this server")
+    parser.add_argument("--stub", action="store_true", help="Serve mock analyses without loading a model")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Artificial per-request delay for --stub")
+    args = parser.parse_args()
+
+    backend = StubVisionBackend(args.stub_latency) if args.stub else create_vision_backend(args.backend)
+    try:
+        asyncio.run(InferenceServer(backend, args.address).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
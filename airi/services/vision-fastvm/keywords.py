@@ -0,0 +1,139 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+DEFAULT_VOCAB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "keywords.json")
+
+# Tokens are runs of word characters; '+' and '#' are kept so terms like "c++" and "c#" survive
+TOKEN_PATTERN = re.compile(r"[\w+#]+")
+
+CATEGORY_MODES = ("first", "all")
+
+
+class KeywordClassifier:
+    """Single-pass keyword classifier compiled from a vocabulary file
+
+    Every term of every category is normalized with the same tokenizer used on
+    responses and compiled into one phrase index, so classifying a response is
+    a single token scan whose cost does not grow with the vocabulary size.
+    Matches are whole-word: "web" does not fire on "website" and "code" does
+    not fire on "vscode".
+    """
+
+    def __init__(self, vocab: Dict[str, Any]):
+        self.version = vocab.get("version", 1)
+        self._compile(vocab)
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "KeywordClassifier":
+        """Load and compile a vocabulary JSON file"""
+        path = path or settings.keyword_vocab_path or DEFAULT_VOCAB_PATH
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Lowercase and split text into match tokens"""
+        return TOKEN_PATTERN.findall(text.lower())
+
+    def _compile(self, vocab: Dict[str, Any]):
+        """Compile all vocabularies into one phrase index"""
+        categories = vocab.get("categories")
+        if not isinstance(categories, dict) or not categories:
+            raise ValueError("Vocabulary must define a non-empty 'categories' object")
+
+        # phrase -> list of (slot, rank); slot indexes self._slots, rank is rule order
+        index: Dict[str, List[Tuple[int, int]]] = {}
+        self._slots: List[Tuple[str, str, List[Any]]] = []
+        self.defaults: Dict[str, Any] = {}
+        self.labels: Dict[str, List[str]] = {}
+
+        for name, spec in categories.items():
+            mode = spec.get("mode", "first")
+            if mode not in CATEGORY_MODES:
+                raise ValueError(f"Category '{name}' has invalid mode '{mode}', expected one of {CATEGORY_MODES}")
+            slot = len(self._slots)
+            rules = spec.get("rules", [])
+            self._slots.append((name, mode, [rule["label"] for rule in rules]))
+            self.defaults[name] = spec.get("default") if mode == "first" else None
+            self.labels[name] = [rule["label"] for rule in rules]
+            self._index_rules(index, slot, name, rules)
+
+        relevance = vocab.get("relevance", {})
+        self.relevance_base = float(relevance.get("base", 0.5))
+        self.relevance_max = float(relevance.get("max", 1.0))
+        rules = relevance.get("rules", [])
+        self._relevance_slot = len(self._slots)
+        self._relevance_weights = [float(rule["weight"]) for rule in rules]
+        self._slots.append(("relevance_score", "sum", [rule["label"] for rule in rules]))
+        self._index_rules(index, self._relevance_slot, "relevance", rules)
+
+        self._index = {phrase: tuple(hits) for phrase, hits in index.items()}
+        self._max_phrase_len = max((phrase.count(" ") + 1 for phrase in self._index), default=1)
+        # First tokens of multi-word phrases; only these positions need n-gram lookups
+        self._phrase_heads = {phrase.split(" ", 1)[0] for phrase in self._index if " " in phrase}
+
+    def _index_rules(self, index: Dict[str, List[Tuple[int, int]]], slot: int, name: str, rules: List[Dict[str, Any]]):
+        """Add one category's rules to the phrase index"""
+        for rank, rule in enumerate(rules):
+            if "label" not in rule or not rule.get("terms"):
+                raise ValueError(f"Rule {rank} in '{name}' needs a 'label' and non-empty 'terms'")
+            for term in rule["terms"]:
+                tokens = self.tokenize(term)
+                if not tokens:
+                    raise ValueError(f"Term {term!r} in '{name}' has no matchable characters")
+                hits = index.setdefault(" ".join(tokens), [])
+                if (slot, rank) not in hits:
+                    hits.append((slot, rank))
+
+    def _scan(self, text: str) -> List[set]:
+        """Collect the matched rule ranks per slot in one pass over the tokens"""
+        matched = [set() for _ in self._slots]
+        tokens = self.tokenize(text)
+        index = self._index
+        heads = self._phrase_heads
+        max_len = self._max_phrase_len
+        count = len(tokens)
+
+        for i, token in enumerate(tokens):
+            hits = index.get(token)
+            if hits:
+                for slot, rank in hits:
+                    matched[slot].add(rank)
+            if token in heads:
+                for n in range(2, min(max_len, count - i) + 1):
+                    hits = index.get(" ".join(tokens[i:i + n]))
+                    if hits:
+                        for slot, rank in hits:
+                            matched[slot].add(rank)
+        return matched
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        """Classify a response into every category at once"""
+        matched = self._scan(text)
+        result: Dict[str, Any] = {}
+
+        for slot, (name, mode, labels) in enumerate(self._slots):
+            ranks = matched[slot]
+            if mode == "first":
+                result[name] = labels[min(ranks)] if ranks else self.defaults[name]
+            elif mode == "all":
+                result[name] = [labels[rank] for rank in sorted(ranks)]
+
+        score = self.relevance_base + sum(self._relevance_weights[rank] for rank in matched[self._relevance_slot])
+        result["relevance_score"] = min(self.relevance_max, score)
+        return result
+
+
+_classifier: Optional[KeywordClassifier] = None
+
+
+def get_classifier() -> KeywordClassifier:
+    """Return the shared classifier, compiling it on first use"""
+    global _classifier
+    if _classifier is None:
+        _classifier = KeywordClassifier.from_file()
+    return _classifier
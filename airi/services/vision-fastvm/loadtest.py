@@ -0,0 +1,310 @@
+"""Load test the /ws fan-out and message handling
+
+Usage:
+    python loadtest.py --spawn-server                   # start a mock-vision server and test it
+    python loadtest.py --connections 500 --slow-fraction 0.2 --duration 60 --spawn-server
+    python loadtest.py --url http://127.0.0.1:8100 --server-pid 1234
+
+Opens --connections WebSocket clients at --ramp connections per second, a
+fraction of which read deliberately slowly. After the ramp every client
+sends ping / get_state / manual_capture messages at random intervals while
+/test/mock-comment is hit at --broadcast-rate to trigger broadcasts.
+
+Reports connection capacity, broadcast delivery latency (receive time minus
+the server's context.timestamp, so client and server should share a clock),
+per-message round trips and server memory per connection (from
+/proc/<pid>/status, so Linux only and only with --spawn-server or
+--server-pid). --spawn-server runs uvicorn with VISION_BACKEND=mock, so no
+model or display is needed (CAPTURE_BACKEND=synthetic generates the frames).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+import websockets
+
+MESSAGE_MIX = [("ping", "pong", 0.6), ("get_state", "state", 0.3), ("manual_capture", "analysis", 0.1)]
+
+
+class LoadStats:
+    """Counters and latency samples shared by all clients"""
+
+    def __init__(self):
+        self.open = 0
+        self.peak_open = 0
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.errors: Counter = Counter()
+        self.broadcasts = 0
+        self.expected_deliveries = 0
+        self.delivered = 0
+        self.broadcast_latency: Dict[bool, List[float]] = {False: [], True: []}
+        self.fanout_time: List[float] = []
+        self.sent: Counter = Counter()
+        self.rtt: Dict[str, List[float]] = {reply: [] for _, reply, _ in MESSAGE_MIX}
+        self.error_replies = 0
+
+
+def percentiles(samples: List[float]) -> str:
+    """p50/p90/p99/max in milliseconds"""
+    if not samples:
+        return "n/a"
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return f"p50 {at(0.5):.1f}  p90 {at(0.9):.1f}  p99 {at(0.99):.1f}  max {ordered[-1] * 1000:.1f} ms"
+
+
+def read_rss(pid: Optional[int]) -> Optional[int]:
+    """Resident set size of a process in bytes (Linux only)"""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def raise_fd_limit():
+    """Hundreds of sockets need more than the common default of 1024 descriptors"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def http_get(url: str, timeout: float = 30.0) -> bytes:
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+async def run_client(ws_url: str, slow: bool, args, stats: LoadStats, traffic: asyncio.Event, stop: asyncio.Event):
+    """One companion client: read everything, send traffic once the ramp is over"""
+    try:
+        # A slow reader buffers at most one message so backpressure reaches the server's socket
+        ws = await websockets.connect(
+            ws_url,
+            max_queue=1 if slow else 32,
+            open_timeout=args.connect_timeout,
+            ping_interval=None
+        )
+    except Exception as e:
+        stats.connect_failures += 1
+        stats.errors[f"connect: {type(e).__name__}"] += 1
+        return
+
+    stats.connected += 1
+    stats.open += 1
+    stats.peak_open = max(stats.peak_open, stats.open)
+    pending: Dict[str, deque] = {reply: deque() for _, reply, _ in MESSAGE_MIX}
+
+    async def send_traffic():
+        await traffic.wait()
+        kinds = [kind for kind, _, _ in MESSAGE_MIX]
+        weights = [weight for _, _, weight in MESSAGE_MIX]
+        replies = {kind: reply for kind, reply, _ in MESSAGE_MIX}
+        while not stop.is_set():
+            await asyncio.sleep(random.expovariate(args.message_rate))
+            kind = random.choices(kinds, weights)[0]
+            pending[replies[kind]].append(time.monotonic())
+            await ws.send(json.dumps({"type": kind}))
+            stats.sent[kind] += 1
+
+    async def close_on_stop():
+        await stop.wait()
+        await ws.close()
+
+    sender = asyncio.create_task(send_traffic())
+    closer = asyncio.create_task(close_on_stop())
+    try:
+        async for raw in ws:
+            received = time.time()
+            message = json.loads(raw)
+            kind = message.get("type")
+            if kind == "companion_comment":
+                stats.delivered += 1
+                stats.broadcast_latency[slow].append(received - message["context"]["timestamp"])
+            elif kind in pending and pending[kind]:
+                stats.rtt[kind].append(time.monotonic() - pending[kind].popleft())
+            elif kind == "error":
+                stats.error_replies += 1
+            if slow:
+                await asyncio.sleep(args.slow_delay)
+    except websockets.ConnectionClosed:
+        pass
+    except Exception as e:
+        stats.errors[f"recv: {type(e).__name__}"] += 1
+    finally:
+        if not stop.is_set():
+            stats.disconnects += 1
+        stats.open -= 1
+        if sender.done() and not sender.cancelled():
+            error = sender.exception()
+            if error is not None and not isinstance(error, websockets.ConnectionClosed):
+                stats.errors[f"send: {type(error).__name__}"] += 1
+        sender.cancel()
+        closer.cancel()
+
+
+async def run_broadcasts(base_url: str, args, stats: LoadStats, stop: asyncio.Event):
+    """Trigger broadcasts through the mock-comment endpoint at a fixed rate"""
+    url = f"{base_url}/test/mock-comment"
+    while not stop.is_set():
+        started = time.monotonic()
+        stats.broadcasts += 1
+        stats.expected_deliveries += stats.open
+        try:
+            # The endpoint returns once the comment is queued for every client; delivery is measured client side
+            await asyncio.to_thread(http_get, url)
+            stats.fanout_time.append(time.monotonic() - started)
+        except Exception as e:
+            stats.errors[f"broadcast: {type(e).__name__}"] += 1
+        await asyncio.sleep(max(0.0, 1.0 / args.broadcast_rate - (time.monotonic() - started)))
+
+
+def spawn_server(host: str, port: int, latency: float) -> subprocess.Popen:
+    """Start the service with the mock vision backend and synthetic capture"""
+    env = dict(os.environ, VISION_BACKEND="mock", MOCK_VISION_LATENCY=str(latency), CAPTURE_BACKEND="synthetic")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env
+    )
+
+
+async def wait_for_server(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await asyncio.to_thread(http_get, f"{base_url}/", 2.0)
+            return
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Server at {base_url} did not come up within {timeout}s")
+            await asyncio.sleep(0.5)
+
+
+async def run(args) -> LoadStats:
+    base_url = args.url.rstrip("/")
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    stats = LoadStats()
+    traffic = asyncio.Event()
+    stop = asyncio.Event()
+
+    baseline_rss = read_rss(args.server_pid)
+    slow_count = int(args.connections * args.slow_fraction)
+    print(f"Opening {args.connections} connections ({slow_count} slow readers) at {args.ramp:g}/s...")
+
+    clients = []
+    ramp_start = time.monotonic()
+    for i in range(args.connections):
+        clients.append(asyncio.create_task(run_client(ws_url, i < slow_count, args, stats, traffic, stop)))
+        await asyncio.sleep(1.0 / args.ramp)
+    # Let the last handshakes finish before measuring
+    await asyncio.sleep(min(args.connect_timeout, 2.0))
+    ramp_time = time.monotonic() - ramp_start
+    ramp_rss = read_rss(args.server_pid)
+
+    print(f"{stats.open} open after {ramp_time:.1f}s; running traffic for {args.duration:g}s...")
+    traffic.set()
+    broadcaster = asyncio.create_task(run_broadcasts(base_url, args, stats, stop))
+    await asyncio.sleep(args.duration)
+    loaded_rss = read_rss(args.server_pid)
+
+    stop.set()
+    await asyncio.gather(broadcaster, return_exceptions=True)
+    await asyncio.gather(*clients, return_exceptions=True)
+
+    report(args, stats, baseline_rss, ramp_rss, loaded_rss)
+    return stats
+
+
+def report(args, stats: LoadStats, baseline_rss: Optional[int], ramp_rss: Optional[int], loaded_rss: Optional[int]):
+    print()
+    print("Connections")
+    print(f"  requested {args.connections}, connected {stats.connected}, failed {stats.connect_failures}, "
+          f"peak open {stats.peak_open}, dropped during run {stats.disconnects}")
+
+    print("Broadcasts")
+    delivery = stats.delivered / stats.expected_deliveries * 100 if stats.expected_deliveries else 0.0
+    print(f"  triggered {stats.broadcasts}, delivered {stats.delivered}/{stats.expected_deliveries} ({delivery:.1f}%)")
+    print(f"  delivery latency   {percentiles(stats.broadcast_latency[False])}")
+    if stats.broadcast_latency[True]:
+        print(f"  slow readers       {percentiles(stats.broadcast_latency[True])}")
+    print(f"  server queueing    {percentiles(stats.fanout_time)}")
+
+    print("Messages")
+    for kind, reply, _ in MESSAGE_MIX:
+        answered = len(stats.rtt[reply])
+        print(f"  {kind:<15} sent {stats.sent[kind]:>6}  answered {answered:>6}  {percentiles(stats.rtt[reply])}")
+    if stats.error_replies:
+        print(f"  error replies {stats.error_replies}")
+
+    print("Server memory")
+    if baseline_rss is None or ramp_rss is None:
+        print("  n/a (pass --spawn-server or --server-pid on Linux)")
+    else:
+        per_connection = (ramp_rss - baseline_rss) / stats.peak_open if stats.peak_open else 0.0
+        print(f"  RSS idle {baseline_rss / 2**20:.1f} MB, connected {ramp_rss / 2**20:.1f} MB"
+              f"{f', under load {loaded_rss / 2**20:.1f} MB' if loaded_rss else ''}")
+        print(f"  ~{per_connection / 1024:.1f} KB per connection")
+
+    if stats.errors:
+        print("Errors")
+        for error, count in stats.errors.most_common():
+            print(f"  {error}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8100", help="Service base URL")
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--ramp", type=float, default=50.0, help="New connections per second")
+    parser.add_argument("--slow-fraction", type=float, default=0.1, help="Fraction of clients that read slowly")
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="Seconds a slow reader sleeps per message")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic after the ramp")
+    parser.add_argument("--message-rate", type=float, default=0.5, help="Messages per second per client")
+    parser.add_argument("--broadcast-rate", type=float, default=2.0, help="Broadcasts per second")
+    parser.add_argument("--connect-timeout", type=float, default=10.0)
+    parser.add_argument("--server-pid", type=int, help="PID of an already running server, for memory stats")
+    parser.add_argument("--spawn-server", action="store_true", help="Start uvicorn with the mock vision backend")
+    parser.add_argument("--mock-latency", type=float, default=0.05, help="Mock analysis delay for --spawn-server")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    server = None
+    if args.spawn_server:
+        host, _, port = args.url.split("://", 1)[-1].rstrip("/").rpartition(":")
+        server = spawn_server(host, int(port), args.mock_latency)
+        args.server_pid = server.pid
+    try:
+        if server:
+            asyncio.run(wait_for_server(args.url.rstrip("/"), 60.0))
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
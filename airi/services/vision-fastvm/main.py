@@ -1,18 +1,24 @@
 import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from PIL import Image
-import json
 import time
 from datetime import datetime
 
 from config import settings
-from capture import ScreenCapture
-from vision import FastVLMVision
+from capture import create_screen_capture, frame_digest
+from backends import create_vision_backend
 from engagement import EngagementEngine
+from coalesce import SingleFlight
+from archive import ScreenshotArchiver
+from quality import QualityController
+from pipeline import Pipeline, Stage
+from memory import MemoryGovernor, deep_sizeof
+from profiling import span, capture_profile, samples_to_folded, samples_to_chrome
+from protocol import ClientSession, StateTracker, negotiate
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -31,12 +37,41 @@ app.add_middleware(
 )
 
 # Initialize components
-screen_capture = ScreenCapture()
-vision_model = FastVLMVision()
+screen_capture = create_screen_capture()
+vision_model = create_vision_backend()
 engagement_engine = EngagementEngine()
+screenshot_archiver = ScreenshotArchiver()
+quality_controller = QualityController()
 
-# WebSocket connections
+# Memory budget: account the large buffers and shed them when RSS nears the budget
+memory_governor = MemoryGovernor()
+memory_governor.account("frame_pool", lambda: screen_capture.frame_pool.pooled_bytes + screen_capture.frame_pool.in_use_bytes)
+memory_governor.account("vision", vision_model.memory_usage)
+memory_governor.account("archive_queue", lambda: screenshot_archiver.queued_bytes)
+memory_governor.account("engagement_activity", lambda: deep_sizeof(engagement_engine.activity_buffer))
+
+# Cheapest quality level allowed at each memory pressure level
+MEMORY_QUALITY_FLOORS = {0: None, 1: "reduced", 2: "minimal"}
+
+def shed_memory(level: int):
+    """React to memory pressure: shed caches and buffers, and cap quality"""
+    screen_capture.frame_pool.set_pressure(level > 0)
+    vision_model.set_memory_pressure(level)
+    screenshot_archiver.paused = level > 0
+    if level:
+        while len(engagement_engine.activity_buffer) > 3:
+            engagement_engine.activity_buffer.popleft()
+    quality_controller.set_floor(MEMORY_QUALITY_FLOORS[level])
+
+memory_governor.on_pressure(shed_memory)
+
+# Request coalescing: analyses are shared per frame digest, manual captures per window
+analysis_flight = SingleFlight(ttl=settings.analysis_reuse_seconds)
+manual_capture_flight = SingleFlight(ttl=settings.manual_capture_coalesce_window)
+
+# WebSocket connections and the protocol each one negotiated
 active_connections: List[WebSocket] = []
+client_sessions: Dict[WebSocket, ClientSession] = {}
 
 # Service state
 service_state = {
@@ -47,6 +82,20 @@ service_state = {
     "personality_mood": "cheerful"
 }
 
+# Versioned service_state for clients that stream snapshots and deltas
+state_tracker = StateTracker()
+
+async def publish_state():
+    """Send streaming clients a delta for whatever changed in service_state"""
+    if not any(session.streams_state for session in client_sessions.values()):
+        return
+    delta = state_tracker.update(service_state)
+    if delta:
+        # Only queued on each client's outbox, so slow clients never hold up analysis or
+        # the HTTP handlers; a delta dropped for a client that is too far behind shows up
+        # as a version gap and the client resyncs
+        await broadcast_comment(delta)
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize the service on startup"""
@@ -56,10 +105,20 @@ async def startup_event():
     await vision_model.load_model()
     service_state["model_loaded"] = vision_model.is_loaded
     
-    # Start the capture loop
-    asyncio.create_task(capture_and_analyze_loop())
+    # Let capture resize frames straight to the model's input size
+    screen_capture.model_input_size = vision_model.input_size
+    
+    # Start the screenshot archive worker (no-op unless enabled)
+    screenshot_archiver.start()
+    
+    # Start watching the memory budget (no-op unless set)
+    memory_governor.start()
+    
+    # Start the capture pipeline
+    frame_pipeline.start()
     
     service_state["is_running"] = True
+    await publish_state()
     print("Service started successfully!")
 
 @app.on_event("shutdown")
@@ -68,77 +127,154 @@ async def shutdown_event():
     print("Shutting down FastVLM Vision Service...")
     screen_capture.stop_capture()
     service_state["is_running"] = False
+    await frame_pipeline.stop()
+    await memory_governor.stop()
+    await screenshot_archiver.stop()
+    await vision_model.close()
 
-async def capture_and_analyze_loop():
-    """Main loop for capturing and analyzing screens"""
-    while service_state["is_running"]:
-        try:
-            if not service_state["capture_active"]:
-                await asyncio.sleep(1)
-                continue
-            
-            # Capture screen
-            screenshot = await screen_capture.capture_screen()
-            
-            if screenshot:
-                # Detect user state
-                user_state = screen_capture.detect_user_state()
-                engagement_engine.update_user_state(user_state)
-                
-                # Analyze with FastVLM
-                analysis = await vision_model.analyze_screenshot(screenshot)
-                service_state["last_analysis"] = analysis
-                
-                # Add to activity buffer
-                engagement_engine.add_activity(analysis)
-                
-                # Check if should engage
-                if engagement_engine.should_engage(analysis, user_state):
-                    # Generate comment
-                    comment = engagement_engine.generate_comment(
-                        analysis,
-                        service_state.get("personality_mood", "cheerful")
-                    )
-                    
-                    # Record engagement
-                    engagement_engine.record_engagement()
-                    
-                    # Send to all connected clients
-                    await broadcast_comment({
-                        "type": "companion_comment",
-                        "comment": comment,
-                        "context": {
-                            "activity": analysis.get("activity"),
-                            "user_state": user_state,
-                            "timestamp": time.time()
-                        }
-                    })
-            
-            # Wait for next capture
-            await asyncio.sleep(settings.capture_interval)
-            
-        except Exception as e:
-            print(f"Error in capture loop: {e}")
-            await asyncio.sleep(settings.capture_interval)
+async def capture_stage() -> Optional[Dict[str, Any]]:
+    """Pipeline source: capture the next frame at the current quality level"""
+    if not service_state["capture_active"]:
+        await asyncio.sleep(1)
+        return None
+    
+    # Wait for next capture
+    await asyncio.sleep(settings.capture_interval)
+    
+    start_time = time.time()
+    
+    # Capture screen
+    with span("pipeline.capture"):
+        screenshot = await screen_capture.capture_screen()
+    if not screenshot:
+        return None
+    
+    # Detect user state
+    user_state = screen_capture.detect_user_state()
+    engagement_engine.update_user_state(user_state)
+    
+    return {"screenshot": screenshot, "user_state": user_state, "start_time": start_time}
 
-async def broadcast_comment(message: Dict[str, Any]):
-    """Broadcast a comment to all connected WebSocket clients"""
-    if not active_connections:
-        return
+async def analyze_stage(frame: Dict[str, Any]) -> Dict[str, Any]:
+    """Pipeline stage: hash, archive and analyze a frame"""
+    screenshot = frame["screenshot"]
+    
+    # Hash once for archive dedup and analysis sharing
+    with span("pipeline.digest"):
+        digest = await asyncio.to_thread(frame_digest, screenshot)
+    screenshot_archiver.submit(screenshot, digest)
+    
+    # Analyze with FastVLM
+    with span("pipeline.analyze"):
+        analysis = await analyze_frame(screenshot, digest, frame["start_time"])
+    service_state["last_analysis"] = analysis
+    # A remote backend only learns these once its inference server is up
+    service_state["model_loaded"] = vision_model.is_loaded
+    screen_capture.model_input_size = vision_model.input_size
+    await publish_state()
+    
+    # Add to activity buffer
+    engagement_engine.add_activity(analysis)
+    
+    frame["analysis"] = analysis
+    return frame
+
+async def engage_stage(frame: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Pipeline stage: decide whether to comment on an analyzed frame"""
+    analysis = frame["analysis"]
+    user_state = frame["user_state"]
+    
+    # Check if should engage
+    if not engagement_engine.should_engage(analysis, user_state):
+        return None
+    
+    # Generate comment
+    comment = engagement_engine.generate_comment(
+        analysis,
+        service_state.get("personality_mood", "cheerful")
+    )
+    
+    # Engagement is recorded only once the broadcast queue accepts the comment (on_forward below),
+    # so a dropped comment doesn't use up the rate limit
+    return {
+        "type": "companion_comment",
+        "comment": comment,
+        "context": {
+            "activity": analysis.get("activity"),
+            "user_state": user_state,
+            "monitor_id": analysis.get("monitor_id"),
+            "timestamp": time.time()
+        }
+    }
+
+async def broadcast_stage(message: Dict[str, Any]):
+    """Pipeline stage: send a comment to all connected clients"""
+    await broadcast_comment(message)
+
+# Capture -> analyze -> engage -> broadcast, each stage behind its own bounded queue
+frame_pipeline = Pipeline(capture_stage, [
+    Stage("analyze", analyze_stage, settings.analyze_queue_size, settings.analyze_queue_policy,
+          settings.analyze_concurrency),
+    Stage("engage", engage_stage, settings.engage_queue_size, settings.engage_queue_policy,
+          on_forward=lambda comment: engagement_engine.record_engagement()),
+    Stage("broadcast", broadcast_stage, settings.broadcast_queue_size, settings.broadcast_queue_policy,
+          settings.broadcast_concurrency),
+])
+
+async def analyze_frame(screenshot: Image.Image, digest: Optional[str] = None,
+                        start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Analyze a frame, sharing work with identical frames analyzed concurrently or just before
+    
+    With start_time, the capture-to-analysis latency (including queueing) is
+    fed to the quality controller, but only when this call ran the analysis:
+    results reused from another frame say nothing about the current level,
+    and neither do heuristic frames in between model runs.
+    """
+    if digest is None:
+        digest = await asyncio.to_thread(frame_digest, screenshot)
     
-    message_json = json.dumps(message)
-    disconnected = []
+    async def analyze() -> Dict[str, Any]:
+        heuristic_level = quality_controller.level["model_every"] == 0
+        ran_model = quality_controller.use_model()
+        if ran_model:
+            analysis = await vision_model.analyze_screenshot(screenshot, digest=digest)
+        else:
+            analysis = vision_model.analyze_heuristic(screen_capture.active_window_title)
+        analysis["monitor_id"] = screenshot.info.get("monitor_id")
+        analysis["frame_digest"] = digest
+        if start_time is not None and (ran_model or heuristic_level):
+            quality_controller.record(time.time() - start_time)
+        return analysis
+    
+    return await analysis_flight.do((screenshot.info.get("monitor_id"), digest), analyze)
+
+async def run_manual_capture() -> Optional[Dict[str, Any]]:
+    """Capture and analyze the screen on demand"""
+    screenshot = await screen_capture.capture_screen(force=True)
+    if not screenshot:
+        return None
+    return await analyze_frame(screenshot)
+
+async def broadcast_comment(message: Dict[str, Any]):
+    """Broadcast a message to all connected WebSocket clients, encoded once per protocol
     
-    for connection in active_connections:
-        try:
-            await connection.send_text(message_json)
-        except:
-            disconnected.append(connection)
+    Only queues the message on each client's outbox; the clients' writer
+    tasks send it, so a slow reader never holds up the others.
+    """
+    if not client_sessions:
+        return
     
-    # Remove disconnected clients
-    for conn in disconnected:
-        if conn in active_connections:
-            active_connections.remove(conn)
+    with span("pipeline.broadcast"):
+        state_only = message.get("type") == "state_delta"
+        payloads = {}
+        
+        for session in list(client_sessions.values()):
+            if state_only and not session.streams_state:
+                continue
+            codec = session.codec
+            if codec.name not in payloads:
+                payloads[codec.name] = codec.encode(message)
+            session.offer(payloads[codec.name])
 
 @app.get("/")
 async def root():
@@ -159,14 +295,63 @@ async def get_stats():
         "engagement": engagement_engine.get_engagement_stats(),
         "vision": {
             "model_loaded": vision_model.is_loaded,
-            "context_summary": vision_model.get_context_summary()
+            "context_summary": vision_model.get_context_summary(),
+            "backend": vision_model.get_stats()
+        },
+        "pipeline": frame_pipeline.get_stats(),
+        "quality": quality_controller.get_stats(),
+        "memory": memory_governor.get_stats(),
+        "websocket": {
+            "connections": len(active_connections),
+            "protocols": {
+                name: sum(1 for session in client_sessions.values() if session.codec.name == name)
+                for name in ("json", "msgpack")
+            },
+            "streaming": sum(1 for session in client_sessions.values() if session.streams_state),
+            "queued": sum(session.outbox.qsize() for session in client_sessions.values()),
+            "dropped": sum(session.dropped for session in client_sessions.values()),
+            "state": state_tracker.get_stats()
+        },
+        "archive": screenshot_archiver.get_stats(),
+        "coalescing": {
+            "analysis": analysis_flight.get_stats(),
+            "manual_capture": manual_capture_flight.get_stats()
         }
     }
 
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 5.0, mode: str = "spans", format: str = "folded"):
+    """Profile the running service for a few seconds (requires debug_endpoints)
+    
+    mode "spans" records the instrumented pipeline sections, mode "sample"
+    samples every thread's Python stack. format "folded" returns collapsed
+    stacks for flamegraph.pl/speedscope, "chrome" returns a Chrome trace for
+    chrome://tracing or Perfetto.
+    """
+    if not settings.debug_endpoints:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if mode not in ("spans", "sample"):
+        raise HTTPException(status_code=400, detail="Invalid mode. Must be one of: ['spans', 'sample']")
+    if format not in ("folded", "chrome"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be one of: ['folded', 'chrome']")
+    
+    seconds = min(max(seconds, 0.1), settings.profile_max_seconds)
+    try:
+        result = await capture_profile(seconds, mode, settings.profile_sample_interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if mode == "spans":
+        return JSONResponse(result.to_chrome()) if format == "chrome" else PlainTextResponse(result.to_folded())
+    if format == "chrome":
+        return JSONResponse(samples_to_chrome(result, settings.profile_sample_interval))
+    return PlainTextResponse(samples_to_folded(result))
+
 @app.post("/capture/start")
 async def start_capture():
     """Start screen capture"""
     service_state["capture_active"] = True
+    await publish_state()
     return {"status": "capture started"}
 
 @app.post("/capture/stop")
@@ -174,6 +359,7 @@ async def stop_capture():
     """Stop screen capture"""
     service_state["capture_active"] = False
     screen_capture.stop_capture()
+    await publish_state()
     return {"status": "capture stopped"}
 
 @app.post("/personality/mood")
@@ -185,6 +371,7 @@ async def set_personality_mood(mood: str):
         raise HTTPException(status_code=400, detail=f"Invalid mood. Must be one of: {valid_moods}")
     
     service_state["personality_mood"] = mood
+    await publish_state()
     return {"status": "mood updated", "mood": mood}
 
 @app.get("/privacy/settings")
@@ -204,62 +391,102 @@ async def update_blacklist(apps: List[str]):
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time communication"""
-    await websocket.accept()
+    """WebSocket endpoint for real-time communication
+    
+    Clients that negotiate a protocol (see protocol.py) get a versioned state
+    snapshot on connect and get_state, then state_delta messages; legacy
+    clients get the full service_state as JSON.
+    """
+    session = negotiate(websocket, settings.ws_queue_size)
+    await websocket.accept(subprotocol=session.subprotocol)
     active_connections.append(websocket)
+    client_sessions[websocket] = session
+    # All sends to this client go through its outbox, so a slow reader only holds up itself
+    writer = asyncio.create_task(session.run_writer(websocket, settings.ws_send_timeout))
     
-    try:
-        # Send initial connection message
-        await websocket.send_json({
-            "type": "connection",
-            "status": "connected",
-            "service_state": service_state
-        })
-        
-        # Keep connection alive
+    async def send_snapshot():
+        # Bring the tracker up to date first so the snapshot is current
+        await publish_state()
+        await session.send(state_tracker.snapshot())
+    
+    async def receive_messages():
         while True:
             # Receive messages from client
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                return
+            try:
+                message = session.decode(frame)
+            except ValueError:
+                await session.send({
+                    "type": "error",
+                    "message": "Invalid JSON" if frame.get("text") is not None else "Invalid MessagePack"
+                })
+                continue
+            
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                
                 # Handle different message types
                 if message.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
+                    await session.send({"type": "pong"})
                 elif message.get("type") == "get_state":
-                    await websocket.send_json({
-                        "type": "state",
-                        "data": service_state
+                    if session.streams_state:
+                        await send_snapshot()
+                    else:
+                        await session.send({
+                            "type": "state",
+                            "data": service_state
+                        })
+                elif message.get("type") == "ask":
+                    # Text-only follow-up about a frame, answered from cached image features
+                    last_analysis = service_state.get("last_analysis") or {}
+                    digest = message.get("frame_digest") or last_analysis.get("frame_digest")
+                    answer = await vision_model.ask_about_frame(digest, message.get("question", "")) if digest else None
+                    await session.send({
+                        "type": "answer",
+                        "frame_digest": digest,
+                        "answer": answer
                     })
                 elif message.get("type") == "manual_capture":
-                    # Trigger manual capture
-                    screenshot = await screen_capture.capture_screen()
-                    if screenshot:
-                        analysis = await vision_model.analyze_screenshot(screenshot)
-                        await websocket.send_json({
+                    # Trigger manual capture, shared with concurrent requests
+                    analysis = await manual_capture_flight.do("manual_capture", run_manual_capture)
+                    if analysis:
+                        await session.send({
                             "type": "analysis",
                             "data": analysis
                         })
-                        
-            except WebSocketDisconnect:
-                break
-            except json.JSONDecodeError:
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "Invalid JSON"
-                })
             except Exception as e:
-                await websocket.send_json({
+                await session.send({
                     "type": "error",
                     "message": str(e)
                 })
-                
-    except WebSocketDisconnect:
-        pass
+    
+    receiver = None
+    try:
+        # Send initial connection message
+        if session.streams_state:
+            await session.send({"type": "connection", "status": "connected", "protocol": session.codec.name})
+            await send_snapshot()
+        else:
+            await session.send({
+                "type": "connection",
+                "status": "connected",
+                "service_state": service_state
+            })
+        
+        # Serve until the client disconnects or a send fails or times out
+        receiver = asyncio.create_task(receive_messages())
+        await asyncio.wait({receiver, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if writer.done() and not writer.cancelled() and isinstance(writer.exception(), asyncio.TimeoutError):
+            print(f"Disconnecting WebSocket client that took over {settings.ws_send_timeout}s to accept a message")
     finally:
         # Clean up connection
+        for task in (receiver, writer):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(task for task in (receiver, writer) if task is not None), return_exceptions=True)
         if websocket in active_connections:
             active_connections.remove(websocket)
+        client_sessions.pop(websocket, None)
 
 @app.get("/test/mock-comment")
 async def test_mock_comment():
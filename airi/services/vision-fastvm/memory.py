@@ -0,0 +1,243 @@
+import asyncio
+import ctypes
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PRESSURE_LEVELS = ("normal", "soft", "hard")
+# Leave pressure only once RSS is this fraction of the budget below the soft limit
+PRESSURE_HYSTERESIS = 0.05
+
+
+def image_nbytes(img: Image.Image) -> int:
+    """Approximate pixel memory of a PIL image (3-band images are stored as 4 bytes per pixel)"""
+    bands = len(img.getbands())
+    return img.width * img.height * (4 if bands == 3 else bands)
+
+
+def deep_sizeof(obj: Any, _seen: Optional[set] = None) -> int:
+    """Approximate bytes held by nested dicts, lists and plain values"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def read_rss(pid: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+    """(resident, file-backed shared) bytes of a process; shared includes mmap'd weights
+
+    Reads /proc on Linux and falls back to psutil elsewhere (macOS has no
+    /proc); (None, None) if neither works.
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            fields = f.read().split()
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return int(fields[1]) * page_size, int(fields[2]) * page_size
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        try:
+            info = psutil.Process(pid).memory_info()
+        except psutil.Error:
+            return None, None
+        return info.rss, getattr(info, "shared", None)
+    return None, None
+
+
+def release_allocator_caches():
+    """Hand freed memory back to the OS: PIL's block cache and glibc's heap"""
+    Image.core.clear_cache()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class FramePool:
+    """Reusable full-resolution grab buffers keyed by mode and size
+
+    Capture decodes every grab into a pooled image with Image.frombytes
+    instead of allocating a new multi-megabyte buffer per frame. Released
+    images go back to the free list as long as the pool stays within
+    max_bytes; under memory pressure pooling is switched off and the free
+    list is emptied.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self._free: Dict[Tuple[str, Tuple[int, int]], List[Image.Image]] = {}
+        self.pooled_bytes = 0
+        self.in_use_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, mode: str, size: Tuple[int, int]) -> Image.Image:
+        """Get a pooled image (contents undefined) or allocate a new one"""
+        free = self._free.get((mode, size))
+        if free:
+            img = free.pop()
+            self.pooled_bytes -= image_nbytes(img)
+            self.hits += 1
+        else:
+            img = Image.new(mode, size)
+            self.misses += 1
+        self.in_use_bytes += image_nbytes(img)
+        return img
+
+    def release(self, img: Image.Image):
+        """Return an image obtained from acquire; it must not be used afterwards"""
+        nbytes = image_nbytes(img)
+        self.in_use_bytes -= nbytes
+        if not self.enabled or self.pooled_bytes + nbytes > self.max_bytes:
+            return
+        img.info.clear()
+        self._free.setdefault((img.mode, img.size), []).append(img)
+        self.pooled_bytes += nbytes
+
+    def set_pressure(self, active: bool):
+        """Stop pooling and drop free buffers while memory is tight"""
+        self.enabled = self.max_bytes > 0 and not active
+        if active:
+            self._free.clear()
+            self.pooled_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pooled_bytes": self.pooled_bytes,
+            "in_use_bytes": self.in_use_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class MemoryGovernor:
+    """Keep the process within memory_budget_mb
+
+    Components report their accounted bytes through `account`; functions
+    registered with `on_pressure` are called with the pressure level (0
+    normal, 1 soft, 2 hard) whenever it changes and on every check while it
+    stays raised, so caches that refill are shed again. RSS is sampled every
+    memory_check_interval seconds.
+    """
+
+    def __init__(self):
+        self.budget = settings.memory_budget_mb * 1024 * 1024
+        self.soft_limit = settings.memory_soft_limit
+        self.components: Dict[str, Callable[[], Any]] = {}
+        self.handlers: List[Callable[[int], None]] = []
+        self.pressure = 0
+        self.sheds = 0
+        self.peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def account(self, name: str, fn: Callable[[], Any]):
+        """Register a component whose fn returns its bytes (or a dict of named byte counts)"""
+        self.components[name] = fn
+
+    def on_pressure(self, fn: Callable[[int], None]):
+        """Register a handler called with the pressure level"""
+        self.handlers.append(fn)
+
+    def start(self):
+        if self.budget and not self._task:
+            if read_rss()[0] is None:
+                print(f"Memory budget of {self.budget / 2**20:.0f} MB is not enforced: cannot read this "
+                      f"process's RSS on {sys.platform} (install psutil)")
+                return
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error checking memory: {e}")
+            await asyncio.sleep(settings.memory_check_interval)
+
+    def check(self) -> int:
+        """Sample RSS, update the pressure level and notify handlers"""
+        rss, _ = read_rss()
+        if rss is None:
+            return self.pressure
+        self.peak_rss = max(self.peak_rss, rss)
+
+        level = self._pressure_level(rss / self.budget)
+        changed = level != self.pressure
+        if changed:
+            print(f"Memory pressure {PRESSURE_LEVELS[self.pressure]} -> {PRESSURE_LEVELS[level]} "
+                  f"(RSS {rss / 2**20:.0f} MB, budget {self.budget / 2**20:.0f} MB)")
+            self.pressure = level
+        if level or changed:
+            self.sheds += bool(level)
+            for handler in self.handlers:
+                handler(level)
+            release_allocator_caches()
+        return level
+
+    def _pressure_level(self, ratio: float) -> int:
+        if ratio >= 1.0:
+            return 2
+        if ratio >= self.soft_limit:
+            return 1
+        # Stay in soft pressure until comfortably below the limit to avoid flapping
+        if self.pressure and ratio >= self.soft_limit - PRESSURE_HYSTERESIS:
+            return 1
+        return 0
+
+    def _accounted(self) -> Tuple[Dict[str, Any], int]:
+        breakdown: Dict[str, Any] = {}
+        total = 0
+        for name, fn in self.components.items():
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Error accounting memory for {name}: {e}")
+                continue
+            breakdown[name] = value
+            total += sum(value.values()) if isinstance(value, dict) else value
+        return breakdown, total
+
+    def get_stats(self) -> Dict[str, Any]:
+        """RSS breakdown: file-backed vs anonymous, accounted components and the remainder"""
+        rss, shared = read_rss()
+        breakdown, accounted = self._accounted()
+        pil = Image.core.get_stats()
+        breakdown["pil_block_cache"] = pil.get("blocks_cached", 0) * Image.core.get_block_size()
+        accounted += breakdown["pil_block_cache"]
+        return {
+            "budget": self.budget or None,
+            "pressure": PRESSURE_LEVELS[self.pressure],
+            "rss": rss,
+            "peak_rss": max(self.peak_rss, rss or 0),
+            "rss_file_backed": shared,
+            "rss_anonymous": rss - shared if rss is not None and shared is not None else None,
+            "accounted": breakdown,
+            "accounted_total": accounted,
+            # Model activations, interpreter and library overhead
+            "unaccounted": rss - accounted if rss is not None else None,
+            "sheds": self.sheds,
+        }
@@ -0,0 +1,197 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+POLICIES = ("block", "drop", "coalesce")
+
+# Window over which per-stage throughput is reported
+THROUGHPUT_WINDOW = 10.0
+
+
+def _rate(timestamps: deque, started_at: float) -> float:
+    """Events per second over the last THROUGHPUT_WINDOW seconds (or since start)"""
+    now = time.monotonic()
+    window = min(THROUGHPUT_WINDOW, now - started_at) if started_at else THROUGHPUT_WINDOW
+    if window <= 0:
+        return 0.0
+    return sum(1 for t in timestamps if t >= now - window) / window
+
+
+class StageQueue:
+    """Bounded queue in front of a stage with an overflow policy
+
+    block:    put waits for space, pushing backpressure upstream
+    drop:     a new item is discarded while the queue is full
+    coalesce: the oldest waiting item is replaced, so the newest always wins
+    """
+
+    def __init__(self, maxsize: int, policy: str):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self._queue: asyncio.Queue = asyncio.Queue(self.maxsize)
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked_time = 0.0
+
+    async def put(self, item: Any) -> bool:
+        """Queue an item according to the policy; False if it was dropped"""
+        if self.policy == "block":
+            if self._queue.full():
+                start = time.monotonic()
+                await self._queue.put(item)
+                self.blocked_time += time.monotonic() - start
+            else:
+                self._queue.put_nowait(item)
+        elif self._queue.full() and self.policy == "drop":
+            self.dropped += 1
+            return False
+        else:
+            while self._queue.full():
+                self._queue.get_nowait()
+                self.coalesced += 1
+            self._queue.put_nowait(item)
+        return True
+
+    async def get(self) -> Any:
+        return await self._queue.get()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class Stage:
+    """One pipeline step: a bounded input queue drained by `concurrency` workers
+
+    The handler's return value is passed to the next stage; None ends the
+    item's journey (e.g. a frame that needs no comment). `on_forward` is
+    called with each result the next stage's queue accepted, so work that
+    must only count once an item is really on its way (not dropped) can
+    happen there.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Awaitable[Any]], queue_size: int = 1,
+                 policy: str = "block", concurrency: int = 1,
+                 on_forward: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.handler = handler
+        self.on_forward = on_forward
+        self.queue = StageQueue(queue_size, policy)
+        self.concurrency = max(1, concurrency)
+        self.next: Optional["Stage"] = None
+        self.busy = 0
+        self.processed = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.started_at = 0.0
+        self._completions: deque = deque(maxlen=1024)
+
+    async def put(self, item: Any) -> bool:
+        return await self.queue.put(item)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            self.busy += 1
+            start = time.monotonic()
+            try:
+                result = await self.handler(item)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in {self.name} stage: {e}")
+                result = None
+            finally:
+                finished = time.monotonic()
+                self.total_time += finished - start
+                self.processed += 1
+                self._completions.append(finished)
+            try:
+                # Waiting here on a full "block" queue is what propagates backpressure
+                if result is not None and self.next is not None:
+                    if await self.next.put(result) and self.on_forward is not None:
+                        self.on_forward(result)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error forwarding from {self.name} stage: {e}")
+            finally:
+                self.busy -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get occupancy and throughput metrics"""
+        return {
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "policy": self.queue.policy,
+            "concurrency": self.concurrency,
+            "busy": self.busy,
+            "processed": self.processed,
+            "errors": self.errors,
+            "dropped": self.queue.dropped,
+            "coalesced": self.queue.coalesced,
+            "blocked_time": self.queue.blocked_time,
+            "throughput": _rate(self._completions, self.started_at),
+            "avg_time": self.total_time / self.processed if self.processed else 0.0,
+        }
+
+
+class Pipeline:
+    """A source coroutine feeding a chain of stages
+
+    The source is called in a loop and each non-None item it returns enters
+    the first stage. Every stage runs its own workers, so a slow stage only
+    holds up its neighbours as far as their queue policies allow: with a
+    coalescing queue in front of analysis, capture of the next frame keeps
+    going while the current one is being analyzed.
+    """
+
+    def __init__(self, source: Callable[[], Awaitable[Any]], stages: List[Stage]):
+        self.source = source
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+        self.produced = 0
+        self.started_at = 0.0
+        self._produced_at: deque = deque(maxlen=1024)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Start the source loop and every stage's workers"""
+        self.started_at = time.monotonic()
+        self._tasks.append(asyncio.create_task(self._run_source()))
+        for stage in self.stages:
+            stage.started_at = self.started_at
+            for _ in range(stage.concurrency):
+                self._tasks.append(asyncio.create_task(stage._worker()))
+
+    async def stop(self):
+        """Cancel the source and all workers"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run_source(self):
+        while True:
+            try:
+                item = await self.source()
+            except Exception as e:
+                print(f"Error in pipeline source: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is not None:
+                self.produced += 1
+                self._produced_at.append(time.monotonic())
+                await self.stages[0].put(item)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-stage metrics"""
+        return {
+            "running": bool(self._tasks),
+            "source": {
+                "produced": self.produced,
+                "throughput": _rate(self._produced_at, self.started_at),
+            },
+            "stages": {stage.name: stage.get_stats() for stage in self.stages},
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Stack of open spans in the current task/thread
+_span_stack: contextvars.ContextVar = contextvars.ContextVar("span_stack", default=())
+
+# Active span recorder; None means instrumentation is a no-op
+_recorder: Optional["SpanRecorder"] = None
+_session_lock = threading.Lock()
+
+
+class _NullSpan:
+    """Shared do-nothing span returned while no trace is being recorded"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "recorder", "start", "child_time", "token", "parent_path")
+
+    def __init__(self, name: str, recorder: "SpanRecorder"):
+        self.name = name
+        self.recorder = recorder
+        self.child_time = 0
+
+    def __enter__(self):
+        stack = _span_stack.get()
+        self.parent_path = stack[-1].parent_path + (stack[-1].name,) if stack else ()
+        self.token = _span_stack.set(stack + (self,))
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        _span_stack.reset(self.token)
+        stack = _span_stack.get()
+        if stack:
+            stack[-1].child_time += duration
+        self.recorder.add(self, duration)
+        return False
+
+
+def span(name: str):
+    """Context manager timing a named section while a trace is recorded"""
+    recorder = _recorder
+    if recorder is None:
+        return NULL_SPAN
+    return _Span(name, recorder)
+
+
+def traced(name: str):
+    """Decorator wrapping a sync or async function in a span"""
+    def decorator(fn: Callable):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _recorder is None:
+                    return await fn(*args, **kwargs)
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _lane() -> int:
+    """Trace lane: the asyncio task if there is one, else the thread"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+class SpanRecorder:
+    """Collects finished spans for one trace session"""
+
+    def __init__(self, max_events: int = 200_000):
+        self.max_events = max_events
+        self.events: List[Tuple[Tuple[str, ...], int, int, int, int]] = []
+        self.dropped = 0
+        self.started_ns = time.perf_counter_ns()
+
+    def add(self, s: _Span, duration: int):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        # (path, start, duration, exclusive time, lane)
+        self.events.append((s.parent_path + (s.name,), s.start, duration, duration - s.child_time, _lane()))
+
+    def to_folded(self) -> str:
+        """Collapsed stacks weighted by exclusive microseconds (flamegraph.pl / speedscope)"""
+        weights: Counter = Counter()
+        for path, _, _, exclusive, _ in self.events:
+            weights[";".join(path)] += max(0, exclusive) // 1000
+        return "".join(f"{stack} {weight}\n" for stack, weight in weights.items() if weight)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace event format (chrome://tracing, Perfetto, speedscope)"""
+        pid = os.getpid()
+        events = [
+            {
+                "name": path[-1],
+                "cat": path[0].split(".", 1)[0],
+                "ph": "X",
+                "ts": (start - self.started_ns) / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": lane,
+            }
+            for path, start, duration, _, lane in self.events
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_events": self.dropped}}
+
+
+def _record_spans(seconds: float) -> SpanRecorder:
+    global _recorder
+    recorder = SpanRecorder()
+    _recorder = recorder
+    try:
+        time.sleep(seconds)
+    finally:
+        _recorder = None
+    return recorder
+
+
+def _sample_stacks(seconds: float, interval: float) -> Counter:
+    """Sample every thread's Python stack at a fixed interval"""
+    own = threading.get_ident()
+    samples: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return samples
+
+
+async def capture_profile(seconds: float, mode: str = "spans", interval: float = 0.005) -> Any:
+    """Record spans or sample stacks of the running service for a fixed time
+
+    Returns a SpanRecorder for mode "spans" or a Counter of folded stacks for
+    mode "sample". Only one session can run at a time.
+    """
+    if not _session_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already being captured")
+    try:
+        if mode == "spans":
+            return await asyncio.to_thread(_record_spans, seconds)
+        if mode == "sample":
+            return await asyncio.to_thread(_sample_stacks, seconds, interval)
+        raise ValueError(f"Unknown profile mode {mode!r}, expected spans or sample")
+    finally:
+        _session_lock.release()
+
+
+def samples_to_folded(samples: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in samples.items())
+
+
+def samples_to_chrome(samples: Counter, interval: float) -> Dict[str, Any]:
+    """Approximate sampled stacks as a flat chrome trace of aggregated frames"""
+    events = []
+    for stack, count in samples.most_common():
+        frames = stack.split(";")
+        events.append({
+            "name": frames[-1],
+            "cat": frames[0],
+            "ph": "X",
+            "ts": 0,
+            "dur": count * interval * 1e6,
+            "pid": os.getpid(),
+            "tid": frames[0],
+            "args": {"stack": stack, "samples": count},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,171 @@
+"""WebSocket wire protocols for /ws
+
+Legacy clients (no subprotocol) get JSON text frames and the full
+service_state on connect and on get_state, exactly as before.
+
+Clients that offer one of SUBPROTOCOLS in Sec-WebSocket-Protocol (or pass
+?protocol=msgpack / ?protocol=json) opt into state streaming:
+
+    {"type": "state_snapshot", "version": v, "data": {...}}   on connect and get_state
+    {"type": "state_delta", "version": v, "patch": {...}}     after every state change
+
+A delta applies to the state at version v - 1 as an RFC 7386 merge patch
+(nested objects are merged, null removes a key, anything else replaces).
+Deltas not newer than the client's version are ignored; a client that
+sees a version gap should send get_state to resync. With
+the msgpack protocol every server message is a MessagePack binary frame;
+clients may send either MessagePack binary or JSON text frames.
+
+Everything sent to a client goes through its own bounded outbox, drained
+by a writer task, so one slow reader only ever holds up itself. Broadcasts
+to a client whose outbox is full are dropped (for state deltas that is a
+version gap). A client that takes longer than the send timeout to accept
+a message is disconnected.
+"""
+import asyncio
+import copy
+import json
+from typing import Any, Dict, Optional, Union
+
+from fastapi import WebSocket
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SUBPROTOCOLS = {
+    "vision.msgpack.v1": "msgpack",
+    "vision.json.v1": "json",
+}
+
+
+class Codec:
+    """JSON text frames"""
+
+    name = "json"
+
+    def encode(self, message: Dict[str, Any]) -> Union[str, bytes]:
+        return json.dumps(message)
+
+    async def send(self, websocket: WebSocket, payload: Union[str, bytes]):
+        await websocket.send_text(payload)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack binary frames"""
+
+    name = "msgpack"
+
+    def encode(self, message: Dict[str, Any]) -> Union[str, bytes]:
+        return msgpack.packb(message, use_bin_type=True, default=str)
+
+    async def send(self, websocket: WebSocket, payload: Union[str, bytes]):
+        await websocket.send_bytes(payload)
+
+
+CODECS = {"json": Codec(), "msgpack": MsgpackCodec()}
+
+
+class ClientSession:
+    """Per-connection protocol choice and outbound queue"""
+
+    def __init__(self, codec: Codec, streams_state: bool, subprotocol: Optional[str] = None,
+                 queue_size: int = 64):
+        self.codec = codec
+        self.streams_state = streams_state
+        self.subprotocol = subprotocol
+        # Encoded messages waiting for the writer task
+        self.outbox: asyncio.Queue = asyncio.Queue(max(1, queue_size))
+        self.dropped = 0
+
+    async def send(self, message: Dict[str, Any]):
+        """Queue a reply, waiting for outbox space (replies are never dropped)"""
+        await self.outbox.put(self.codec.encode(message))
+
+    def offer(self, payload: Union[str, bytes]) -> bool:
+        """Queue an already encoded broadcast without waiting; False if the outbox is full"""
+        try:
+            self.outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    async def run_writer(self, websocket: WebSocket, timeout: float):
+        """Send queued messages in order; raises once a send fails or takes longer than timeout"""
+        while True:
+            payload = await self.outbox.get()
+            await asyncio.wait_for(self.codec.send(websocket, payload), timeout)
+
+    @staticmethod
+    def decode(frame: Dict[str, Any]) -> Dict[str, Any]:
+        """Decode a websocket.receive frame; raises ValueError on malformed input"""
+        if frame.get("bytes") is not None:
+            if msgpack is None:
+                raise ValueError("Binary frames need the msgpack package on the server")
+            message = msgpack.unpackb(frame["bytes"], raw=False)
+        else:
+            message = json.loads(frame.get("text") or "")
+        if not isinstance(message, dict):
+            raise ValueError("Messages must be objects")
+        return message
+
+
+def negotiate(websocket: WebSocket, queue_size: int = 64) -> ClientSession:
+    """Pick the protocol from the offered subprotocols or the ?protocol= query parameter"""
+    for offered in websocket.scope.get("subprotocols", []):
+        name = SUBPROTOCOLS.get(offered)
+        if name == "msgpack" and msgpack is None:
+            continue
+        if name:
+            return ClientSession(CODECS[name], True, offered, queue_size)
+
+    name = websocket.query_params.get("protocol")
+    if name in CODECS and (name != "msgpack" or msgpack is not None):
+        return ClientSession(CODECS[name], True, queue_size=queue_size)
+    return ClientSession(CODECS["json"], False, queue_size=queue_size)
+
+
+def merge_patch(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """RFC 7386 merge patch that turns old into new (None values are treated as absent)"""
+    patch = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = merge_patch(previous, value)
+            if nested:
+                patch[key] = nested
+        elif key not in old or value != previous:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+class StateTracker:
+    """Versioned copy of service_state producing snapshots and merge-patch deltas"""
+
+    def __init__(self):
+        self.version = 0
+        self._published: Dict[str, Any] = {}
+        self.deltas = 0
+
+    def update(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Record the current state; returns a delta message if anything changed"""
+        current = copy.deepcopy(state)
+        patch = merge_patch(self._published, current)
+        if not patch:
+            return None
+        self.version += 1
+        self._published = current
+        self.deltas += 1
+        return {"type": "state_delta", "version": self.version, "patch": patch}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The state as of the current version (later changes arrive as deltas)"""
+        return {"type": "state_snapshot", "version": self.version, "data": self._published}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"version": self.version, "deltas": self.deltas, "msgpack_available": msgpack is not None}
@@ -0,0 +1,142 @@
+import math
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from config import settings
+
+# Longest the step-up cooldown grows to after repeated flapping, as a multiple of the base
+MAX_COOLDOWN_BACKOFF = 8
+
+
+def build_quality_levels() -> List[Dict[str, Any]]:
+    """Quality ladder from best to cheapest
+
+    The vision tower takes a fixed input size and the schema needs its full
+    token budget, so smaller frames or tighter token caps would not make a
+    frame cheaper. Levels instead run the model on every `model_every`-th
+    frame and give the frames in between the heuristic analysis.
+    """
+    return [
+        # Level 0 is exactly the configured behaviour
+        {"name": "full", "model_every": 1},
+        {"name": "reduced", "model_every": 2},
+        {"name": "minimal", "model_every": 4},
+        # Last resort: skip the model and classify the active window title
+        {"name": "heuristic", "model_every": 0},
+    ]
+
+
+class QualityController:
+    """Move along the quality ladder to keep end-to-end latency under a target
+
+    Latencies are collected over a window of frames. When the p90 of a full
+    window exceeds `latency_target` the controller steps one level cheaper;
+    when it falls below `latency_target * latency_headroom` it steps one level
+    back up. The window is cleared after every change so each level is judged
+    on its own measurements. A floor set by the memory governor keeps the
+    effective level at least that cheap regardless of latency.
+    
+    Cheap levels are fast by construction (the heuristic level barely takes
+    any time), so stepping up waits at least `latency_upgrade_cooldown`
+    seconds after the last change. A step up that has to be undone within
+    the cooldown doubles it, up to MAX_COOLDOWN_BACKOFF times the base; a
+    step down that is not such a reversal resets it.
+    """
+
+    def __init__(self, levels: Optional[List[Dict[str, Any]]] = None):
+        self.enabled = settings.adaptive_quality
+        self.target = settings.latency_target
+        self.headroom = settings.latency_headroom
+        self.levels = levels or build_quality_levels()
+        self.level_index = 0
+        self.floor_index = 0
+        self.samples = deque(maxlen=settings.latency_window)
+        self.last_latency = 0.0
+        self.last_change_time = 0.0
+        self.last_step_up_time = 0.0
+        self.base_cooldown = settings.latency_upgrade_cooldown
+        self.cooldown = self.base_cooldown
+        self.step_downs = 0
+        self.step_ups = 0
+        self._frames_since_model = 0
+
+    @property
+    def level(self) -> Dict[str, Any]:
+        """Current quality level"""
+        return self.levels[max(self.level_index, self.floor_index)]
+
+    def set_floor(self, name: Optional[str]):
+        """Never run better than the named level (None removes the floor)"""
+        index = next((i for i, level in enumerate(self.levels) if level["name"] == name), 0)
+        if index != self.floor_index:
+            print(f"Quality floor {self.levels[self.floor_index]['name']} -> {self.levels[index]['name']}")
+            self.floor_index = index
+
+    def use_model(self) -> bool:
+        """Whether the next frame goes to the model; the others get the heuristic analysis"""
+        every = self.level["model_every"]
+        if not every:
+            return False
+        self._frames_since_model += 1
+        if self._frames_since_model < every:
+            return False
+        self._frames_since_model = 0
+        return True
+
+    def record(self, latency: float):
+        """Record one end-to-end latency and adjust the level if needed"""
+        self.last_latency = latency
+        if not self.enabled:
+            return
+        self.samples.append(latency)
+        if len(self.samples) < self.samples.maxlen:
+            return
+
+        p90 = self._percentile(90)
+        current_time = time.time()
+        if p90 > self.target and self.level_index < len(self.levels) - 1:
+            if current_time - self.last_step_up_time < self.cooldown:
+                # The last step up did not hold; wait longer before trying again
+                self.cooldown = min(self.cooldown * 2, self.base_cooldown * MAX_COOLDOWN_BACKOFF)
+            else:
+                self.cooldown = self.base_cooldown
+            self._set_level(self.level_index + 1, p90)
+            self.step_downs += 1
+        elif (p90 < self.target * self.headroom and self.level_index > 0
+              and current_time - self.last_change_time >= self.cooldown):
+            self._set_level(self.level_index - 1, p90)
+            self.last_step_up_time = self.last_change_time
+            self.step_ups += 1
+
+    def _set_level(self, index: int, p90: float):
+        """Switch levels and start a fresh measurement window"""
+        previous = self.levels[self.level_index]["name"]
+        self.level_index = index
+        self.samples.clear()
+        self.last_change_time = time.time()
+        print(f"Quality level {previous} -> {self.levels[index]['name']} (p90 latency {p90:.2f}s, target {self.target:.2f}s)")
+
+    def _percentile(self, pct: float) -> float:
+        """Nearest-rank percentile of the current window"""
+        ordered = sorted(self.samples)
+        rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[rank]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get controller state"""
+        return {
+            "enabled": self.enabled,
+            "level": self.level["name"],
+            "level_index": self.level_index,
+            "floor": self.levels[self.floor_index]["name"],
+            "levels": [level["name"] for level in self.levels],
+            "settings": self.level,
+            "target_latency": self.target,
+            "last_latency": self.last_latency,
+            "p90_latency": self._percentile(90) if self.samples else None,
+            "last_change": self.last_change_time,
+            "upgrade_cooldown": self.cooldown,
+            "step_downs": self.step_downs,
+            "step_ups": self.step_ups,
+        }
@@ -0,0 +1,367 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from config import settings
+from backends import VisionBackend
+
+
+def _replica_main(replica_id: int, conn, num_threads: int):
+    """Entry point of a replica process: load a model copy and serve requests over the pipe"""
+    import torch
+    from vision import FastVLMVision
+
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    vision = FastVLMVision()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(vision.load_model())
+    conn.send(("ready", None, (vision.is_loaded, vision.input_size)))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        op, request_id = message[0], message[1]
+        if op == "stop":
+            break
+        elif op == "ping":
+            conn.send(("pong", request_id, None))
+        elif op == "analyze":
+            mode, size, data, kwargs = message[2]
+            try:
+                image = Image.frombytes(mode, size, data)
+                analysis = loop.run_until_complete(vision.analyze_screenshot(image, **kwargs))
+                if analysis.get("mock") and vision.is_loaded:
+                    # analyze_screenshot answered a failure with a mock; report it so the pool sees it
+                    raise RuntimeError(analysis.get("error", "analysis failed"))
+                conn.send(("result", request_id, analysis))
+            except Exception as e:
+                conn.send(("error", request_id, f"Replica {replica_id}: {e}"))
+
+
+class Replica:
+    """Parent-side handle for one replica process"""
+
+    def __init__(self, replica_id: int):
+        self.replica_id = replica_id
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn = None
+        self.ready = False
+        self.is_loaded = False
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.sent_at: Dict[int, float] = {}
+        self.send_lock = threading.Lock()
+        self.ready_future: Optional[asyncio.Future] = None
+        self.ready_task: Optional[asyncio.Task] = None
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.restarts = 0
+        self.total_time = 0.0
+        self.last_latency = 0.0
+        self.started_at = 0.0
+
+    @property
+    def load(self) -> int:
+        """Requests currently dispatched to this replica"""
+        return len(self.pending)
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_time / self.requests if self.requests else 0.0
+
+    def oldest_request_age(self) -> float:
+        """Seconds the oldest in-flight request has been waiting"""
+        return time.monotonic() - min(self.sent_at.values()) if self.sent_at else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-replica metrics"""
+        return {
+            "replica_id": self.replica_id,
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "ready": self.ready,
+            "model_loaded": self.is_loaded,
+            "in_flight": self.load,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "restarts": self.restarts,
+            "avg_latency": self.avg_latency,
+            "last_latency": self.last_latency,
+            "uptime": time.time() - self.started_at if self.started_at else 0.0,
+        }
+
+
+class ReplicaPool(VisionBackend):
+    """Pool of model replicas in worker processes with least-loaded routing
+
+    Each replica is a separate process holding its own model copy with a
+    pinned torch thread count, so several generate calls run in parallel on
+    many-core CPUs. Frames are dispatched to the ready replica with the fewest
+    in-flight requests. A health task restarts replicas whose process died,
+    whose oldest request exceeded replica_request_timeout or that failed
+    replica_max_errors requests in a row. Context tracking and the heuristic
+    path stay in the API process.
+    """
+
+    name = "pool"
+
+    def __init__(self, size: Optional[int] = None, threads: Optional[int] = None):
+        super().__init__()
+        self.size = max(1, size or settings.num_workers)
+        cpu_count = os.cpu_count() or 1
+        self.threads = threads or settings.replica_threads or max(1, cpu_count // self.size)
+        self.replicas: List[Replica] = [Replica(i) for i in range(self.size)]
+        self._request_ids = itertools.count()
+        self._context = multiprocessing.get_context("spawn")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def load_model(self):
+        """Start every replica and wait until they have loaded their model"""
+        self._loop = asyncio.get_running_loop()
+        if settings.device != "cpu":
+            print(f"Warning: replica pool on {settings.device} loads {self.size} model copies on the same device")
+        print(f"Starting {self.size} FastVLM replicas with {self.threads} threads each...")
+
+        for replica in self.replicas:
+            self._spawn(replica)
+        await asyncio.gather(*(self._wait_ready(replica) for replica in self.replicas))
+
+        self.is_loaded = any(replica.is_loaded for replica in self.replicas)
+        self._health_task = asyncio.create_task(self._health_loop())
+        ready = sum(replica.ready for replica in self.replicas)
+        print(f"{ready}/{self.size} replicas ready")
+
+    def _spawn(self, replica: Replica):
+        """Start (or restart) a replica process and its response reader"""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_replica_main,
+            args=(replica.replica_id, child_conn, self.threads),
+            name=f"fastvlm-replica-{replica.replica_id}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+
+        replica.process = process
+        replica.conn = parent_conn
+        replica.ready = False
+        replica.consecutive_errors = 0
+        replica.started_at = time.time()
+        replica.ready_future = self._loop.create_future()
+        threading.Thread(
+            target=self._read_responses,
+            args=(replica, parent_conn),
+            name=f"replica-reader-{replica.replica_id}",
+            daemon=True
+        ).start()
+
+    async def _wait_ready(self, replica: Replica):
+        """Wait for a replica to report that its model is loaded"""
+        try:
+            replica.is_loaded, input_size = await asyncio.wait_for(
+                asyncio.shield(replica.ready_future), timeout=settings.replica_start_timeout
+            )
+            self.input_size = self.input_size or input_size
+            replica.ready = True
+        except asyncio.TimeoutError:
+            print(f"Replica {replica.replica_id} did not become ready in {settings.replica_start_timeout}s")
+        except Exception as e:
+            print(f"Replica {replica.replica_id} failed to start: {e}")
+
+    def _read_responses(self, replica: Replica, conn):
+        """Reader thread: hand replica responses back to the event loop"""
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._handle_response, replica, conn, kind, request_id, payload)
+        self._loop.call_soon_threadsafe(self._handle_exit, replica, conn)
+
+    def _handle_response(self, replica: Replica, conn, kind: str, request_id: Optional[int], payload: Any):
+        """Resolve the future waiting on a response (runs on the event loop)"""
+        if conn is not replica.conn:
+            return
+        if kind == "ready":
+            if not replica.ready_future.done():
+                replica.ready_future.set_result(payload)
+            return
+
+        future = replica.pending.pop(request_id, None)
+        sent_at = replica.sent_at.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if sent_at is not None and kind != "pong":
+            replica.last_latency = time.monotonic() - sent_at
+            replica.total_time += replica.last_latency
+            replica.requests += 1
+        if kind == "error":
+            replica.errors += 1
+            replica.consecutive_errors += 1
+            future.set_exception(RuntimeError(payload))
+        else:
+            if kind == "result":
+                replica.consecutive_errors = 0
+            future.set_result(payload)
+
+    def _handle_exit(self, replica: Replica, conn):
+        """Fail everything pending on a replica whose pipe closed"""
+        if conn is not replica.conn:
+            return
+        replica.ready = False
+        if replica.ready_future and not replica.ready_future.done():
+            replica.ready_future.set_exception(RuntimeError("replica exited during startup"))
+        self._fail_pending(replica, "replica exited")
+
+    def _fail_pending(self, replica: Replica, reason: str):
+        for future in replica.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Replica {replica.replica_id} {reason}"))
+        replica.pending.clear()
+        replica.sent_at.clear()
+
+    async def _request(self, replica: Replica, message: tuple, timeout: float) -> Any:
+        """Send a request to a replica and wait for its response"""
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        replica.pending[request_id] = future
+        replica.sent_at[request_id] = time.monotonic()
+        try:
+            # Pipe writes of large frames can block; keep them off the event loop
+            await asyncio.to_thread(self._send, replica, (message[0], request_id) + message[1:])
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            replica.pending.pop(request_id, None)
+            replica.sent_at.pop(request_id, None)
+
+    @staticmethod
+    def _send(replica: Replica, message: tuple):
+        with replica.send_lock:
+            replica.conn.send(message)
+
+    def _pick_replica(self) -> Optional[Replica]:
+        """Least-loaded ready replica, ties broken by average latency"""
+        ready = [replica for replica in self.replicas if replica.ready]
+        if not ready:
+            return None
+        return min(ready, key=lambda replica: (replica.load, replica.avg_latency))
+
+    async def analyze_screenshot(self, image: Image.Image, max_new_tokens: Optional[int] = None,
+                                 digest: Optional[str] = None) -> Dict[str, Any]:
+        """Analyze a screenshot on the least-loaded replica"""
+        replica = self._pick_replica()
+        if replica is None:
+            return self._mock_analysis(image, "no replica ready")
+
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        payload = (image.mode, image.size, image.tobytes(), {"max_new_tokens": max_new_tokens, "digest": digest})
+        try:
+            analysis = await self._request(replica, ("analyze", payload), settings.replica_request_timeout)
+        except Exception as e:
+            print(f"Error analyzing screenshot on replica {replica.replica_id}: {e}")
+            return self._mock_analysis(image, str(e))
+
+        analysis["replica_id"] = replica.replica_id
+        self._record_context(analysis)
+        return analysis
+
+    async def _health_loop(self):
+        """Periodically restart dead or stuck replicas and ping idle ones"""
+        while True:
+            await asyncio.sleep(settings.replica_health_interval)
+            for replica in self.replicas:
+                try:
+                    await self._check_replica(replica)
+                except Exception as e:
+                    print(f"Error checking replica {replica.replica_id}: {e}")
+            self.is_loaded = any(replica.ready and replica.is_loaded for replica in self.replicas)
+
+    async def _check_replica(self, replica: Replica):
+        """Health-check one replica, restarting it if needed"""
+        if replica.ready_future and not replica.ready_future.done():
+            # Still loading; only give up after the start timeout
+            if time.time() - replica.started_at < settings.replica_start_timeout:
+                return
+            return await self._restart(replica, "start timeout")
+
+        if not replica.process.is_alive():
+            return await self._restart(replica, f"exited with code {replica.process.exitcode}")
+        
+        if replica.consecutive_errors >= settings.replica_max_errors:
+            return await self._restart(replica, f"{replica.consecutive_errors} failed requests in a row")
+
+        if replica.load:
+            # A busy replica can't answer pings until generate returns
+            if replica.oldest_request_age() > settings.replica_request_timeout:
+                await self._restart(replica, "request timeout")
+            return
+
+        try:
+            await self._request(replica, ("ping",), timeout=5)
+        except Exception:
+            await self._restart(replica, "ping timeout")
+
+    async def _restart(self, replica: Replica, reason: str):
+        """Kill and respawn a replica"""
+        print(f"Restarting replica {replica.replica_id}: {reason}")
+        replica.ready = False
+        self._fail_pending(replica, f"restarted ({reason})")
+        # terminate() + join() can take seconds; keep them off the event loop
+        await asyncio.to_thread(self._terminate, replica)
+        replica.restarts += 1
+        self._spawn(replica)
+        # Keep a reference so the task is not garbage-collected mid-wait
+        replica.ready_task = asyncio.create_task(self._wait_ready(replica))
+
+    @staticmethod
+    def _terminate(replica: Replica):
+        if replica.process and replica.process.is_alive():
+            replica.process.terminate()
+            replica.process.join(timeout=5)
+        if replica.conn:
+            replica.conn.close()
+
+    async def close(self):
+        """Stop the health task and every replica"""
+        if self._health_task:
+            self._health_task.cancel()
+        for replica in self.replicas:
+            if replica.ready_task:
+                replica.ready_task.cancel()
+            replica.ready = False
+            try:
+                self._send(replica, ("stop", None))
+            except Exception:
+                pass
+        await asyncio.to_thread(lambda: [r.process.join(timeout=5) for r in self.replicas if r.process])
+        for replica in self.replicas:
+            self._fail_pending(replica, "pool closed")
+            await asyncio.to_thread(self._terminate, replica)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool and per-replica metrics"""
+        return {
+            "backend": self.name,
+            "size": self.size,
+            "threads_per_replica": self.threads,
+            "ready": sum(replica.ready for replica in self.replicas),
+            "replicas": [replica.get_stats() for replica in self.replicas],
+        }
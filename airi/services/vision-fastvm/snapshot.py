@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+import torch
+import transformers
+from transformers import AutoConfig, AutoModelForVision2Seq
+
+from config import settings
+
+# Bump whenever load_model's post-load transforms change what a snapshot contains
+SNAPSHOT_FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+WEIGHTS_FILE = "model.pt"
+BUFFERS_FILE = "buffers.pt"
+# A save lock older than this is assumed to belong to a crashed process
+STALE_LOCK_SECONDS = 3600
+
+
+def snapshot_root() -> str:
+    return os.path.join(settings.cache_dir, "snapshots")
+
+
+def snapshot_fingerprint(model_config, dtype: torch.dtype) -> str:
+    """Fingerprint of everything that determines the ready-to-run weights"""
+    key = {
+        "model_name": settings.model_name,
+        "revision": getattr(model_config, "_commit_hash", None),
+        "dtype": str(dtype),
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def load_model_config():
+    """Load the model config (cheap, served from the local HF cache after the first run)"""
+    return AutoConfig.from_pretrained(settings.model_name, trust_remote_code=True)
+
+
+def load_snapshot(model_config, dtype: torch.dtype) -> Optional[torch.nn.Module]:
+    """Memory-map a matching snapshot into a model skeleton; None if there is none
+
+    The weights stay in the page cache, so cpu processes (e.g. replicas) share
+    one copy. On mps the caller's .to(device) copies them off the mapping:
+    loading is still fast, but every process holds its own copy.
+
+    A snapshot that fails to load has the failure recorded in its manifest
+    and is not tried again; delete its directory to retry.
+    """
+    fingerprint = snapshot_fingerprint(model_config, dtype)
+    directory = os.path.join(snapshot_root(), fingerprint)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    manifest = _read_manifest(manifest_path)
+    if manifest is None:
+        return None
+    if manifest.get("load_error"):
+        print(f"Skipping model snapshot {fingerprint}, it failed to load before: {manifest['load_error']}")
+        return None
+
+    start_time = time.time()
+    try:
+        # Build the module tree on the meta device so no weight memory is allocated
+        with torch.device("meta"):
+            model = AutoModelForVision2Seq.from_config(model_config, trust_remote_code=True, torch_dtype=dtype)
+
+        # mmap=True keeps tensors backed by the file's page cache, shared by every cpu process
+        state = torch.load(os.path.join(directory, WEIGHTS_FILE), mmap=True, weights_only=True, map_location="cpu")
+        model.load_state_dict(state, assign=True, strict=True)
+
+        # Non-persistent buffers (e.g. rotary tables) are not part of the state dict
+        buffers = torch.load(os.path.join(directory, BUFFERS_FILE), weights_only=True, map_location="cpu")
+        for name, tensor in buffers.items():
+            module_name, _, buffer_name = name.rpartition(".")
+            model.get_submodule(module_name)._buffers[buffer_name] = tensor
+
+        model.tie_weights()
+        leftover = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+        if leftover:
+            raise ValueError(f"snapshot is missing tensors: {leftover[:5]}")
+
+        model.eval()
+        print(f"Loaded model snapshot {fingerprint} in {time.time() - start_time:.1f}s")
+        return model
+    except Exception as e:
+        print(f"Ignoring unusable model snapshot {fingerprint}: {e}")
+        manifest["load_error"] = str(e) or type(e).__name__
+        try:
+            tmp_path = f"{manifest_path}.tmp-{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, manifest_path)
+        except OSError as write_error:
+            print(f"Could not record the snapshot failure: {write_error}")
+        return None
+
+
+def _read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """The parsed manifest, or None if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def save_snapshot(model: torch.nn.Module, model_config, dtype: torch.dtype):
+    """Write the ready-to-run model to cache_dir and remove stale snapshots of the same model
+
+    Nothing is written if a snapshot with this fingerprint already exists:
+    it either loaded (and this isn't called) or failed in a way a rewrite of
+    the same model would repeat.
+    """
+    fingerprint = snapshot_fingerprint(model_config, dtype)
+    root = snapshot_root()
+    directory = os.path.join(root, fingerprint)
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        return
+    tmp_directory = f"{directory}.tmp-{os.getpid()}"
+    lock_path = f"{directory}.lock"
+    start_time = time.time()
+
+    # Only one process (e.g. one of several replicas) writes a given snapshot
+    os.makedirs(root, exist_ok=True)
+    try:
+        if os.path.exists(lock_path) and time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+            os.remove(lock_path)
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return
+
+    try:
+        os.makedirs(tmp_directory, exist_ok=True)
+        state = {name: tensor.detach().cpu() for name, tensor in model.state_dict().items()}
+        torch.save(state, os.path.join(tmp_directory, WEIGHTS_FILE))
+
+        persistent = set(state)
+        buffers = {name: b.detach().cpu() for name, b in model.named_buffers() if name not in persistent}
+        torch.save(buffers, os.path.join(tmp_directory, BUFFERS_FILE))
+
+        manifest: Dict[str, Any] = {
+            "fingerprint": fingerprint,
+            "model_name": settings.model_name,
+            "revision": getattr(model_config, "_commit_hash", None),
+            "dtype": str(dtype),
+            "format": SNAPSHOT_FORMAT_VERSION,
+            "created": time.time(),
+        }
+        # The manifest is written last; a directory without one is never loaded
+        with open(os.path.join(tmp_directory, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp_directory, directory)
+        print(f"Saved model snapshot {fingerprint} in {time.time() - start_time:.1f}s")
+    except Exception as e:
+        print(f"Error saving model snapshot: {e}")
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        return
+    finally:
+        os.remove(lock_path)
+
+    _remove_stale_snapshots(fingerprint, dtype)
+
+
+def _remove_stale_snapshots(current: str, dtype: torch.dtype):
+    """Delete outdated snapshots (older revision, format or library versions) of the same model and dtype
+
+    Snapshots in other dtypes are kept: a process configured with another
+    dtype still uses them.
+    """
+    root = snapshot_root()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name == current or not os.path.isdir(path):
+            continue
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+            stale = manifest.get("model_name") == settings.model_name and manifest.get("dtype") == str(dtype)
+        except (OSError, ValueError):
+            # Leftover temp directory from an interrupted save
+            stale = ".tmp-" in name and time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,36 @@
+"""Synthetic screen capture for load tests and headless runs
+
+Selected with CAPTURE_BACKEND=synthetic (loadtest.py --spawn-server sets
+it). Frames come from a fake grabber instead of mss, so no display is
+needed, and every grab differs so change detection always fires.
+"""
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from capture import ScreenCapture
+
+
+class SyntheticGrabber:
+    """Stand-in for mss: one synthetic monitor whose colour changes on every grab"""
+
+    def __init__(self, width: int = 1280, height: int = 720):
+        geometry = {"left": 0, "top": 0, "width": width, "height": height}
+        # Index 0 is the virtual union of all monitors, as in mss
+        self.monitors = [geometry, geometry]
+        self.grabs = 0
+
+    def grab(self, geometry: Dict[str, int]) -> SimpleNamespace:
+        self.grabs += 1
+        shade = (self.grabs * 37) % 256
+        raw = bytes((shade, 255 - shade, 128, 0)) * (geometry["width"] * geometry["height"])
+        return SimpleNamespace(width=geometry["width"], height=geometry["height"], raw=raw)
+
+
+class SyntheticScreenCapture(ScreenCapture):
+    """Screen capture that produces synthetic frames"""
+
+    def _open_grabber(self):
+        return SyntheticGrabber()
+
+    def _get_active_window_title(self) -> Optional[str]:
+        return "Synthetic frames"
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        started = 0
+
+        async def work():
+            nonlocal started
+            started += 1
+            await asyncio.sleep(0.01)
+            return started
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+        return flight, started, results
+
+    flight, started, results = run(scenario())
+    assert started == 1
+    assert results == [1] * 5
+    assert flight.get_stats() == {"calls": 5, "executions": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work(value):
+            await asyncio.sleep(0)
+            return value
+
+        return await asyncio.gather(flight.do("a", lambda: work(1)), flight.do("b", lambda: work(2)))
+
+    assert run(scenario()) == [1, 2]
+
+
+def test_results_are_reused_within_ttl_only():
+    async def scenario():
+        flight = SingleFlight(ttl=0.05)
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        first = await flight.do("k", work)
+        reused = await flight.do("k", work)
+        await asyncio.sleep(0.08)
+        fresh = await flight.do("k", work)
+        return first, reused, fresh
+
+    assert run(scenario()) == (1, 1, 2)
+
+
+def test_without_ttl_finished_results_are_not_cached():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        return await flight.do("k", work), await flight.do("k", work)
+
+    assert run(scenario()) == (1, 2)
+
+
+def test_failures_are_shared_but_not_cached():
+    async def scenario():
+        flight = SingleFlight(ttl=10)
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        results = await asyncio.gather(flight.do("k", failing), flight.do("k", failing), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.do("k", failing)
+        return calls, results
+
+    calls, results = run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert calls == 2
+
+
+def test_cancelled_waiter_does_not_cancel_shared_work():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        waiter = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        other = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await other
+
+    assert run(scenario()) == "done"
+
+
+def test_remember_seeds_the_cache():
+    async def scenario():
+        flight = SingleFlight(ttl=10)
+        flight.remember("k", "seeded")
+
+        async def work():
+            return "computed"
+
+        return await flight.do("k", work)
+
+    assert run(scenario()) == "seeded"
@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+
+from comment_templates import DEFAULT_TEMPLATES_PATH, CommentTemplates
+
+
+def make_table(comment="Nice code!", version=1):
+    return {
+        "version": version,
+        "fallback": ["Hmm, interesting."],
+        "default_comment": "Carry on!",
+        "activities": {"coding": {"focused": [comment]}},
+        "description_triggers": [{"keywords": ["error"], "comments": ["Oops, an error."]}],
+        "moods": {"cheerful": {"prefix": "", "suffix": " :)"}},
+    }
+
+
+def write_table(path, table):
+    path.write_text(json.dumps(table), encoding="utf-8")
+    # Bump the mtime explicitly so the change is seen even on coarse filesystem clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def table_path(tmp_path):
+    path = tmp_path / "comments.json"
+    write_table(path, make_table())
+    return path
+
+
+def test_bundled_table_is_valid():
+    templates = CommentTemplates(DEFAULT_TEMPLATES_PATH, reload_interval=0)
+    assert templates.get_stats()["indexed_keys"] > 0
+
+
+def test_lookup_renders_mood(table_path):
+    templates = CommentTemplates(str(table_path), reload_interval=0)
+    assert templates.state_comments("coding", "focused", "cheerful") == ("Nice code! :)",)
+    assert templates.state_comments("gaming", "focused", "unknown") == ("Hmm, interesting.",)
+    assert templates.trigger_comments("An Error dialog", "cheerful") == ("Oops, an error. :)",)
+
+
+@pytest.mark.parametrize("breakage", [
+    lambda t: t.update(fallback=[]),
+    lambda t: t.update(default_comment=None),
+    lambda t: t["activities"]["coding"].update(focused=["", "ok"]),
+    lambda t: t.update(activities=["coding"]),
+    lambda t: t.update(description_triggers=[{"keywords": [], "comments": ["x"]}]),
+    lambda t: t["moods"].update(grumpy={"prefix": "Ugh. ", "colour": "grey"}),
+    lambda t: t["moods"].update(grumpy={"suffix": 3}),
+])
+def test_malformed_table_is_rejected(tmp_path, breakage):
+    table = make_table()
+    breakage(table)
+    path = tmp_path / "comments.json"
+    write_table(path, table)
+    with pytest.raises(ValueError):
+        CommentTemplates(str(path), reload_interval=0)
+
+
+def test_reload_picks_up_changed_file(table_path):
+    templates = CommentTemplates(str(table_path), reload_interval=0)
+    write_table(table_path, make_table("Refactoring time?", version=2))
+
+    assert templates.maybe_reload()
+    assert templates.version == 2
+    assert templates.reload_count == 1
+    assert templates.state_comments("coding", "focused", "") == ("Refactoring time?",)
+    # Unchanged file: nothing to do
+    assert not templates.maybe_reload()
+
+
+def test_failed_reload_keeps_previous_table(table_path):
+    templates = CommentTemplates(str(table_path), reload_interval=0)
+
+    broken = make_table("Should never appear", version=2)
+    broken["fallback"] = "not a list"
+    write_table(table_path, broken)
+    assert not templates.maybe_reload()
+
+    table_path.write_text("{ truncated", encoding="utf-8")
+    assert not templates.maybe_reload()
+
+    assert templates.version == 1
+    assert templates.reload_count == 0
+    assert templates.state_comments("coding", "focused", "cheerful") == ("Nice code! :)",)
+
+
+def test_reload_is_rate_limited(table_path):
+    templates = CommentTemplates(str(table_path), reload_interval=3600)
+    templates.maybe_reload()
+    write_table(table_path, make_table(version=2))
+    assert not templates.maybe_reload()
+    assert templates.version == 1
@@ -0,0 +1,81 @@
+import pytest
+
+from keywords import KeywordClassifier, get_classifier
+
+VOCAB = {
+    "categories": {
+        "application": {
+            "mode": "first",
+            "default": "Unknown",
+            "rules": [
+                {"label": "VSCode", "terms": ["vscode", "visual studio code"]},
+                {"label": "Browser", "terms": ["web", "browser"]},
+                {"label": "IDE", "terms": ["code"]},
+            ],
+        },
+        "elements": {
+            "mode": "all",
+            "rules": [
+                {"label": "cpp", "terms": ["C++"]},
+                {"label": "error", "terms": ["error", "errors"]},
+            ],
+        },
+    },
+    "relevance": {
+        "base": 0.5,
+        "max": 0.9,
+        "rules": [
+            {"label": "error", "weight": 0.3, "terms": ["error"]},
+            {"label": "crash", "weight": 0.3, "terms": ["crash"]},
+        ],
+    },
+}
+
+
+@pytest.fixture
+def classifier():
+    return KeywordClassifier(VOCAB)
+
+
+def test_first_mode_picks_earliest_rule_not_earliest_token(classifier):
+    assert classifier.classify("some code in the web browser and vscode")["application"] == "VSCode"
+
+
+def test_matches_are_whole_words(classifier):
+    assert classifier.classify("a website")["application"] == "Unknown"
+    assert classifier.classify("a vscodeish editor")["application"] == "Unknown"
+
+
+def test_multi_word_phrases(classifier):
+    assert classifier.classify("Visual Studio Code is open")["application"] == "VSCode"
+    # A partial phrase falls through to the single-word rule
+    assert classifier.classify("visual studio and code")["application"] == "IDE"
+
+
+def test_all_mode_returns_labels_in_rule_order_without_duplicates(classifier):
+    result = classifier.classify("errors everywhere in the c++ build, another error")
+    assert result["elements"] == ["cpp", "error"]
+    assert classifier.classify("nothing here")["elements"] == []
+
+
+def test_relevance_is_summed_and_capped(classifier):
+    assert classifier.classify("quiet")["relevance_score"] == 0.5
+    assert classifier.classify("an error")["relevance_score"] == pytest.approx(0.8)
+    assert classifier.classify("error after crash, error again")["relevance_score"] == 0.9
+
+
+def test_invalid_vocabularies_are_rejected():
+    with pytest.raises(ValueError):
+        KeywordClassifier({"categories": {}})
+    with pytest.raises(ValueError):
+        KeywordClassifier({"categories": {"a": {"mode": "any", "rules": []}}})
+    with pytest.raises(ValueError):
+        KeywordClassifier({"categories": {"a": {"rules": [{"label": "x", "terms": []}]}}})
+    with pytest.raises(ValueError):
+        KeywordClassifier({"categories": {"a": {"rules": [{"label": "x", "terms": ["!!"]}]}}})
+
+
+def test_bundled_vocabulary_compiles():
+    result = get_classifier().classify("User is debugging an error in VS Code")
+    assert result["application"] == "VSCode"
+    assert result["activity"] == "coding"
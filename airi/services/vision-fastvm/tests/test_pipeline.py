@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from pipeline import Stage, StageQueue
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def drain(queue):
+    items = []
+    while queue.qsize():
+        items.append(await queue.get())
+    return items
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        StageQueue(1, "lossy")
+
+
+def test_drop_discards_new_items_while_full():
+    async def scenario():
+        queue = StageQueue(2, "drop")
+        for item in range(4):
+            await queue.put(item)
+        return queue, await drain(queue)
+
+    queue, items = run(scenario())
+    assert items == [0, 1]
+    assert queue.dropped == 2
+    assert queue.coalesced == 0
+
+
+def test_coalesce_replaces_oldest_so_newest_wins():
+    async def scenario():
+        queue = StageQueue(2, "coalesce")
+        for item in range(5):
+            await queue.put(item)
+        return queue, await drain(queue)
+
+    queue, items = run(scenario())
+    assert items == [3, 4]
+    assert queue.coalesced == 3
+    assert queue.dropped == 0
+
+
+def test_block_waits_for_space_and_keeps_every_item():
+    async def scenario():
+        queue = StageQueue(1, "block")
+        await queue.put("first")
+        blocked = asyncio.create_task(queue.put("second"))
+        await asyncio.sleep(0.02)
+        waiting = not blocked.done()
+        first = await queue.get()
+        await blocked
+        return queue, waiting, first, await queue.get()
+
+    queue, waiting, first, second = run(scenario())
+    assert waiting
+    assert (first, second) == ("first", "second")
+    assert queue.dropped == 0 and queue.coalesced == 0
+    assert queue.blocked_time > 0
+
+
+def test_maxsize_is_at_least_one():
+    async def scenario():
+        queue = StageQueue(0, "drop")
+        await queue.put("kept")
+        await queue.put("dropped")
+        return queue, await drain(queue)
+
+    queue, items = run(scenario())
+    assert queue.maxsize == 1
+    assert items == ["kept"]
+
+
+def test_put_reports_whether_the_item_was_queued():
+    async def scenario():
+        results = {}
+        for policy in ("drop", "coalesce", "block"):
+            queue = StageQueue(1, policy)
+            first = await queue.put("a")
+            second = await queue.put("b") if policy != "block" else None
+            results[policy] = (first, second)
+        return results
+
+    assert run(scenario()) == {"drop": (True, False), "coalesce": (True, True), "block": (True, None)}
+
+
+def test_on_forward_only_sees_results_the_next_stage_accepted():
+    async def scenario():
+        forwarded = []
+        release = asyncio.Event()
+
+        async def stalled_sink(item):
+            await release.wait()
+
+        async def passthrough(item):
+            return item
+
+        source = Stage("source", passthrough, queue_size=8, on_forward=forwarded.append)
+        sink = Stage("sink", stalled_sink, queue_size=1, policy="drop")
+        source.next = sink
+        workers = [asyncio.create_task(source._worker()), asyncio.create_task(sink._worker())]
+
+        await source.put(0)
+        await asyncio.sleep(0.01)
+        for item in range(1, 4):
+            await source.put(item)
+        await asyncio.sleep(0.01)
+        release.set()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return forwarded, sink.queue.dropped
+
+    forwarded, dropped = run(scenario())
+    # 0 is taken by the stalled sink worker, 1 waits in its queue, 2 and 3 are dropped
+    assert forwarded == [0, 1]
+    assert dropped == 2
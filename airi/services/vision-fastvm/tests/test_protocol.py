@@ -0,0 +1,143 @@
+import asyncio
+import copy
+import json
+
+import pytest
+
+from protocol import CODECS, ClientSession, StateTracker, merge_patch
+
+
+def apply_patch(target, patch):
+    """RFC 7386 merge patch application, as a streaming client does it"""
+    result = copy.deepcopy(target)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = apply_patch(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def test_identical_states_produce_empty_patch():
+    state = {"a": 1, "nested": {"b": [1, 2]}}
+    assert merge_patch(state, copy.deepcopy(state)) == {}
+
+
+def test_changed_and_added_keys_are_included():
+    assert merge_patch({"a": 1, "b": 2}, {"a": 1, "b": 3, "c": 4}) == {"b": 3, "c": 4}
+
+
+def test_nested_objects_are_merged():
+    old = {"stats": {"frames": 1, "errors": 0}, "mood": "cheerful"}
+    new = {"stats": {"frames": 2, "errors": 0}, "mood": "cheerful"}
+    assert merge_patch(old, new) == {"stats": {"frames": 2}}
+
+
+def test_removed_keys_become_none():
+    assert merge_patch({"a": 1, "nested": {"b": 1, "c": 2}}, {"nested": {"b": 1}}) == {
+        "a": None,
+        "nested": {"c": None},
+    }
+
+
+def test_none_values_mean_delete():
+    # A key set to None reads as absent to clients, so publishing None deletes it
+    patch = merge_patch({"last_analysis": {"activity": "coding"}}, {"last_analysis": None})
+    assert patch == {"last_analysis": None}
+    assert apply_patch({"last_analysis": {"activity": "coding"}}, patch) == {}
+
+
+def test_lists_are_replaced_whole():
+    assert merge_patch({"items": [1, 2, 3]}, {"items": [1, 2]}) == {"items": [1, 2]}
+
+
+def test_object_replacing_scalar_is_sent_whole():
+    assert merge_patch({"value": 1}, {"value": {"x": 1}}) == {"value": {"x": 1}}
+
+
+def test_patches_round_trip():
+    old = {"a": 1, "b": {"c": [1], "d": "x"}, "e": True}
+    new = {"a": 2, "b": {"c": [2], "f": None}, "g": "new"}
+    expected = {"a": 2, "b": {"c": [2]}, "g": "new"}
+    assert apply_patch(old, merge_patch(old, new)) == expected
+
+
+def test_tracker_versions_only_advance_on_change():
+    tracker = StateTracker()
+    state = {"is_running": False, "stats": {"frames": 0}}
+
+    first = tracker.update(state)
+    assert first == {"type": "state_delta", "version": 1, "patch": state}
+    assert tracker.update(state) is None
+
+    state["stats"]["frames"] = 1
+    second = tracker.update(state)
+    assert second == {"type": "state_delta", "version": 2, "patch": {"stats": {"frames": 1}}}
+    assert tracker.snapshot() == {"type": "state_snapshot", "version": 2, "data": state}
+    assert tracker.get_stats()["deltas"] == 2
+
+
+def test_tracker_snapshot_is_isolated_from_later_mutation():
+    tracker = StateTracker()
+    state = {"stats": {"frames": 0}}
+    tracker.update(state)
+    state["stats"]["frames"] = 5
+    assert tracker.snapshot()["data"] == {"stats": {"frames": 0}}
+
+
+class FakeWebSocket:
+    def __init__(self, stalled=False):
+        self.stalled = stalled
+        self.sent = []
+
+    async def send_text(self, payload):
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.sent.append(payload)
+
+
+def test_stalled_client_does_not_hold_up_others():
+    async def scenario():
+        fast, slow = FakeWebSocket(), FakeWebSocket(stalled=True)
+        sessions = {ws: ClientSession(CODECS["json"], True, queue_size=2) for ws in (fast, slow)}
+        writers = {ws: asyncio.create_task(session.run_writer(ws, timeout=0.1)) for ws, session in sessions.items()}
+
+        # Broadcasting only queues, so it never waits on the stalled socket
+        for i in range(4):
+            for session in sessions.values():
+                session.offer(json.dumps({"n": i}))
+            await asyncio.sleep(0.01)
+
+        delivered_before_timeout = list(fast.sent)
+        with pytest.raises(asyncio.TimeoutError):
+            await writers[slow]
+        writers[fast].cancel()
+        return delivered_before_timeout, sessions[fast], sessions[slow]
+
+    delivered, fast_session, slow_session = asyncio.run(scenario())
+    assert [json.loads(payload)["n"] for payload in delivered] == [0, 1, 2, 3]
+    assert fast_session.dropped == 0
+    # One message is stuck in the send, two fill the outbox, the last is dropped
+    assert slow_session.dropped == 1
+
+
+def test_replies_wait_for_outbox_space_instead_of_dropping():
+    async def scenario():
+        websocket = FakeWebSocket()
+        session = ClientSession(CODECS["json"], False, queue_size=1)
+        await session.send({"type": "pong"})
+        blocked = asyncio.create_task(session.send({"type": "pong"}))
+        await asyncio.sleep(0.01)
+        waiting = not blocked.done()
+        writer = asyncio.create_task(session.run_writer(websocket, timeout=1.0))
+        await blocked
+        await asyncio.sleep(0.01)
+        writer.cancel()
+        return waiting, websocket.sent, session.dropped
+
+    waiting, sent, dropped = asyncio.run(scenario())
+    assert waiting
+    assert [json.loads(payload) for payload in sent] == [{"type": "pong"}] * 2
+    assert dropped == 0
@@ -0,0 +1,114 @@
+from collections import deque
+
+import pytest
+
+import quality
+from quality import MAX_COOLDOWN_BACKOFF, QualityController, build_quality_levels
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quality.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def controller(clock):
+    controller = QualityController()
+    controller.enabled = True
+    controller.target = 1.0
+    controller.headroom = 0.5
+    controller.base_cooldown = controller.cooldown = 30.0
+    controller.samples = deque(maxlen=4)
+    return controller
+
+
+def feed(controller, latency, count=4):
+    for _ in range(count):
+        controller.record(latency)
+
+
+def test_levels_only_skip_model_runs():
+    levels = build_quality_levels()
+    assert levels[0] == {"name": "full", "model_every": 1}
+    assert levels[-1]["model_every"] == 0
+    # Cheaper levels run the model less often and never cap generation
+    intervals = [level["model_every"] for level in levels[:-1]]
+    assert intervals == sorted(intervals)
+    assert all("max_new_tokens" not in level for level in levels)
+
+
+def test_use_model_follows_the_level_interval(controller):
+    assert [controller.use_model() for _ in range(3)] == [True] * 3
+    controller.level_index = 2
+    runs = [controller.use_model() for _ in range(8)]
+    assert runs.count(True) == 2
+    controller.level_index = len(controller.levels) - 1
+    assert not any(controller.use_model() for _ in range(4))
+
+
+def test_steps_down_only_on_a_full_slow_window(controller):
+    feed(controller, 2.0, count=3)
+    assert controller.level_index == 0
+    controller.record(2.0)
+    assert controller.level["name"] == "reduced"
+    assert controller.step_downs == 1
+    assert not controller.samples
+
+
+def test_step_up_waits_for_cooldown(controller, clock):
+    feed(controller, 2.0)
+    assert controller.level_index == 1
+
+    clock.now += 10
+    feed(controller, 0.1)
+    assert controller.level_index == 1
+
+    clock.now += 25
+    feed(controller, 0.1)
+    assert controller.level_index == 0
+    assert controller.step_ups == 1
+
+
+def test_flapping_doubles_cooldown_up_to_the_cap(controller, clock):
+    feed(controller, 2.0)
+    for _ in range(6):
+        clock.now += controller.cooldown
+        feed(controller, 0.1)
+        assert controller.level_index == 0
+        # The step up does not hold
+        clock.now += 1
+        feed(controller, 2.0)
+        assert controller.level_index == 1
+    assert controller.cooldown == 30.0 * MAX_COOLDOWN_BACKOFF
+
+
+def test_cooldown_resets_after_a_step_up_holds(controller, clock):
+    feed(controller, 2.0)
+    clock.now += 30
+    feed(controller, 0.1)
+    clock.now += 1
+    feed(controller, 2.0)
+    assert controller.cooldown == 60.0
+
+    clock.now += 60
+    feed(controller, 0.1)
+    clock.now += 120
+    feed(controller, 2.0)
+    assert controller.cooldown == 30.0
+
+
+def test_floor_overrides_level(controller):
+    controller.set_floor("minimal")
+    assert controller.level["name"] == "minimal"
+    controller.set_floor(None)
+    assert controller.level["name"] == "full"
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from PIL import Image
+
+import backends
+from backends import RemoteVisionBackend
+from config import settings
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(address):
+    return subprocess.Popen(
+        [sys.executable, "inference_server.py", "--stub", "--address", address],
+        cwd=SERVICE_DIR,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_for_socket(path, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Inference server socket {path} did not appear")
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "vision.sock")
+
+
+@pytest.fixture
+def server(socket_path):
+    process = start_server(f"unix:{socket_path}")
+    wait_for_socket(socket_path)
+    yield process
+    process.terminate()
+    process.wait(timeout=10)
+
+
+def test_frames_round_trip_over_pooled_connections(server, socket_path):
+    async def scenario():
+        backend = RemoteVisionBackend(f"unix:{socket_path}")
+        await backend.load_model()
+        try:
+            sequential = [
+                await backend.analyze_screenshot(Image.new("RGB", (64 + i, 48), (i, 0, 0)), max_new_tokens=8)
+                for i in range(3)
+            ]
+            # RGBA frames are converted before they are framed as raw pixels
+            converted = await backend.analyze_screenshot(Image.new("RGBA", (20, 10)))
+            concurrent = await asyncio.gather(*(
+                backend.analyze_screenshot(Image.new("L", (32, 32))) for _ in range(8)
+            ))
+            return backend, sequential, converted, concurrent
+        finally:
+            await backend.close()
+
+    backend, sequential, converted, concurrent = asyncio.run(scenario())
+    assert backend.is_loaded
+    assert backend.server_info["backend"] == "mock"
+    assert [analysis["image_size"] for analysis in sequential] == [[64, 48], [65, 48], [66, 48]]
+    assert converted["image_size"] == [20, 10]
+    assert all(analysis["image_size"] == [32, 32] for analysis in concurrent)
+    assert not any("error" in analysis for analysis in sequential + [converted] + concurrent)
+    assert backend.errors == 0
+    # Sequential requests reuse one keep-alive connection; concurrency is capped by the pool
+    assert backend.pool.opened <= backend.pool.size
+    assert backend.pool.reused >= 3
+
+
+def test_late_server_is_picked_up_on_first_successful_analysis(socket_path, monkeypatch):
+    monkeypatch.setattr(settings, "vision_server_start_timeout", 0)
+    monkeypatch.setattr(backends, "HEALTH_REPROBE_INTERVAL", 0)
+
+    async def scenario():
+        backend = RemoteVisionBackend(f"unix:{socket_path}")
+        await backend.load_model()
+        loaded_at_start = backend.is_loaded
+        failed = await backend.analyze_screenshot(Image.new("RGB", (8, 8)))
+
+        process = start_server(f"unix:{socket_path}")
+        try:
+            await asyncio.to_thread(wait_for_socket, socket_path)
+            analysis = await backend.analyze_screenshot(Image.new("RGB", (8, 8)))
+            return backend, loaded_at_start, failed, analysis
+        finally:
+            await backend.close()
+            process.terminate()
+            await asyncio.to_thread(process.wait, 10)
+
+    backend, loaded_at_start, failed, analysis = asyncio.run(scenario())
+    assert not loaded_at_start
+    assert failed["mock"] and failed["error"].startswith("inference server:")
+    assert "error" not in analysis
+    assert backend.is_loaded
+    assert backend.server_info["backend"] == "mock"
@@ -1,21 +1,134 @@
 import torch
-from transformers import AutoProcessor, AutoModelForVision2Seq
+from transformers import AutoProcessor, AutoModelForVision2Seq, StoppingCriteria, StoppingCriteriaList
 from PIL import Image
 import asyncio
-from typing import Optional, Dict, Any
-from collections import deque
+import inspect
+from typing import Optional, Dict, Any, List, Tuple
+from collections import OrderedDict
+import re
 import time
 
 from config import settings
+from backends import VisionBackend
+from capture import frame_digest
+from snapshot import load_model_config, load_snapshot, save_snapshot
+from profiling import span
 
-class FastVLMVision:
+FREEFORM_PROMPT = """Describe what the user is doing on their screen. Include:
+            - What application or website they're using
+            - What specific activity they're engaged in
+            - Any notable content or elements visible
+            - The user's apparent state (focused, struggling, browsing, etc.)
+            Be concise and natural, as if you're a companion watching alongside them."""
+
+# Fields of the structured schema, in the order the model is asked to emit them
+SCHEMA_FIELD = re.compile(r"(app|activity|state|elements|relevance)\s*[=:]\s*([^;\n]*)", re.IGNORECASE)
+# Free-text elements carried into the synthesized description
+MAX_NOTED_ELEMENTS = 6
+# Consecutive feature path failures (other than out-of-memory) before it is given up on
+MAX_FEATURE_PATH_FAILURES = 3
+# The schema is complete once the relevance number has been terminated
+SCHEMA_COMPLETE = re.compile(r"relevance\s*[=:]\s*\d*\.?\d+\s*[;\n]", re.IGNORECASE)
+
+def strip_prompt(sequences: torch.Tensor, prompt_ids: Optional[torch.Tensor]) -> torch.Tensor:
+    """Drop the prompt from generate output if it was echoed
+    
+    Decoder-only models given input_ids return prompt + new tokens, but
+    models that generate from inputs_embeds (llava_qwen among them) return
+    only the new tokens, so the prefix is compared rather than assumed.
+    """
+    if prompt_ids is None:
+        return sequences
+    length = prompt_ids.shape[1]
+    if sequences.shape[1] >= length and torch.equal(sequences[:, :length], prompt_ids.to(sequences.device)):
+        return sequences[:, length:]
+    return sequences
+
+class SchemaStoppingCriteria(StoppingCriteria):
+    """Stop generation as soon as the structured schema line is complete"""
+    
+    def __init__(self, tokenizer, prompt_ids: Optional[torch.Tensor] = None):
+        self.tokenizer = tokenizer
+        self.prompt_ids = prompt_ids
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = [
+            SCHEMA_COMPLETE.search(self.tokenizer.decode(row, skip_special_tokens=True)) is not None
+            for row in strip_prompt(input_ids, self.prompt_ids)
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+class FeatureCache:
+    """LRU cache of encoded image features keyed by frame digest, bounded by bytes"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        features = self._entries.get(key)
+        if features is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return features
+    
+    def put(self, key: str, features: torch.Tensor):
+        size = self._nbytes(features)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.total_bytes -= self._nbytes(self._entries.pop(key))
+        self._entries[key] = features
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= self._nbytes(evicted)
+            self.evictions += 1
+    
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+    
+    @staticmethod
+    def _nbytes(features: torch.Tensor) -> int:
+        return features.element_size() * features.nelement()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class FastVLMVision(VisionBackend):
+    name = "local"
+    
     def __init__(self):
+        super().__init__()
         self.model = None
         self.processor = None
         self.device = settings.device
         self.dtype = torch.float16 if settings.dtype == "float16" else torch.float32
-        self.context_buffer = deque(maxlen=settings.max_context_buffer)
-        self.is_loaded = False
+        self.structured_prompt = self._build_structured_prompt()
+        self.feature_cache = FeatureCache(settings.feature_cache_mb * 1024 * 1024)
+        self._feature_path: Optional[bool] = None
+        self._feature_path_failures = 0
+        self._image_token_id: Optional[int] = None
+        self._prompt_ids_cache: Dict[Tuple[str, int], torch.Tensor] = {}
+        self._shortest_edge = False
+        self._can_skip_resize = False
+        # Generation runs on a worker thread so the event loop keeps capturing; one call at a time
+        self._inference_lock = asyncio.Lock()
+        self._model_bytes: Optional[int] = None
         
     async def load_model(self):
         """Load the FastVLM model"""
@@ -27,19 +140,33 @@ class FastVLMVision:
                 settings.model_name,
                 trust_remote_code=True
             )
+            # Batched prompts are padded on the left so every row ends where generation starts
+            self.processor.tokenizer.padding_side = "left"
             
-            self.model = AutoModelForVision2Seq.from_pretrained(
-                settings.model_name,
-                trust_remote_code=True,
-                torch_dtype=self.dtype,
-                device_map="auto" if self.device == "cuda" else None
-            )
+            # Snapshots are loaded on CPU; cuda keeps device_map placement via from_pretrained
+            use_snapshot = settings.model_snapshot and self.device != "cuda"
+            model_config = load_model_config() if use_snapshot else None
+            self.model = load_snapshot(model_config, self.dtype) if use_snapshot else None
+            
+            if self.model is None:
+                self.model = AutoModelForVision2Seq.from_pretrained(
+                    settings.model_name,
+                    trust_remote_code=True,
+                    torch_dtype=self.dtype,
+                    device_map="auto" if self.device == "cuda" else None
+                )
+                
+                # Set to evaluation mode
+                self.model.eval()
+                
+                # Save the converted model so later starts can memory-map it
+                if use_snapshot:
+                    await asyncio.to_thread(save_snapshot, self.model, model_config, self.dtype)
             
             if self.device != "cuda":
                 self.model = self.model.to(self.device)
             
-            # Set to evaluation mode
-            self.model.eval()
+            self._detect_input_size()
             
             self.is_loaded = True
             print("FastVLM-7B loaded successfully!")
@@ -49,8 +176,9 @@ class FastVLMVision:
             print("Falling back to mock mode for development")
             self.is_loaded = False
     
-    async def analyze_screenshot(self, image: Image.Image) -> Dict[str, Any]:
-        """Analyze a screenshot and return understanding"""
+    async def analyze_screenshot(self, image: Image.Image, max_new_tokens: Optional[int] = None,
+                                 digest: Optional[str] = None) -> Dict[str, Any]:
+        """Analyze a screenshot and return understanding (max_new_tokens caps generation)"""
         start_time = time.time()
         
         try:
@@ -58,201 +186,437 @@ class FastVLMVision:
                 # Mock response for development
                 return self._mock_analysis(image)
             
-            # Prepare the prompt for scene understanding
-            prompt = """Describe what the user is doing on their screen. Include:
-            - What application or website they're using
-            - What specific activity they're engaged in
-            - Any notable content or elements visible
-            - The user's apparent state (focused, struggling, browsing, etc.)
-            Be concise and natural, as if you're a companion watching alongside them."""
-            
-            # Process image and prompt
-            inputs = self.processor(
-                images=image,
-                text=prompt,
-                return_tensors="pt"
-            ).to(self.device)
+            structured = settings.structured_output
             
-            # Generate response
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=150,
-                    do_sample=True,
-                    temperature=0.7,
-                    top_p=0.9
-                )
+            # Prepare the prompt for scene understanding
+            prompt = self.structured_prompt if structured else FREEFORM_PROMPT
             
-            # Decode response
-            response = self.processor.decode(outputs[0], skip_special_tokens=True)
+            # The feature cache is keyed by digest; hash outside the lock if the caller hasn't already
+            if digest is None and self.feature_cache.max_bytes and self._feature_path_supported():
+                with span("vision.digest"):
+                    digest = await asyncio.to_thread(frame_digest, image)
             
-            # Extract the generated text (remove the prompt)
-            if prompt in response:
-                response = response.replace(prompt, "").strip()
+            # Generate response, reusing cached image features when possible
+            async with self._inference_lock:
+                with span("vision.analyze"):
+                    response, generated_tokens, feature_cache_hit = await asyncio.to_thread(
+                        self._generate, image, prompt, structured, max_new_tokens, digest
+                    )
             
             inference_time = time.time() - start_time
             
             # Parse the response into structured data
-            analysis = self._parse_analysis(response)
+            with span("vision.parse"):
+                analysis = self._parse_structured(response) if structured else None
+                if analysis is None:
+                    analysis = self._parse_analysis(response)
             analysis['inference_time'] = inference_time
+            analysis['generated_tokens'] = generated_tokens
+            analysis['feature_cache_hit'] = feature_cache_hit
             
             # Add to context buffer
-            self.context_buffer.append({
-                'timestamp': time.time(),
-                'analysis': analysis
-            })
+            self._record_context(analysis)
             
             return analysis
             
         except Exception as e:
             print(f"Error analyzing screenshot: {e}")
-            return self._mock_analysis(image)
+            return self._mock_analysis(image, str(e))
     
-    def _parse_analysis(self, response: str) -> Dict[str, Any]:
-        """Parse the model's response into structured data"""
-        # Simple parsing - in production, use more sophisticated NLP
-        analysis = {
-            'description': response,
-            'application': self._extract_application(response),
-            'activity': self._extract_activity(response),
-            'user_state': self._extract_user_state(response),
-            'notable_elements': self._extract_elements(response),
-            'relevance_score': self._calculate_relevance(response)
+    async def analyze_batch(self, images: List[Image.Image], max_new_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Analyze several images with batched generate calls (offline bulk analysis)
+        
+        Unlike analyze_screenshot, errors are raised instead of answered with a
+        mock analysis, and neither the feature cache nor the context buffer is
+        touched.
+        """
+        if not self.is_loaded:
+            return [self._mock_analysis(image) for image in images]
+        
+        structured = settings.structured_output
+        prompt = self.structured_prompt if structured else FREEFORM_PROMPT
+        
+        start_time = time.time()
+        async with self._inference_lock:
+            with span("vision.analyze_batch"):
+                results = await asyncio.to_thread(self._generate_batch, images, prompt, structured, max_new_tokens)
+        inference_time = (time.time() - start_time) / len(images)
+        
+        analyses = []
+        with span("vision.parse"):
+            for response, generated_tokens in results:
+                analysis = self._parse_structured(response) if structured else None
+                if analysis is None:
+                    analysis = self._parse_analysis(response)
+                analysis['inference_time'] = inference_time
+                analysis['generated_tokens'] = generated_tokens
+                analyses.append(analysis)
+        return analyses
+    
+    def _generation_kwargs(self, structured: bool, max_new_tokens: Optional[int],
+                           prompt_ids: Optional[torch.Tensor] = None) -> Dict[str, Any]:
+        """Decoding settings for the structured or free-form prompt"""
+        if structured:
+            # Short greedy decode that stops as soon as the schema line is complete
+            return {
+                "max_new_tokens": min(max_new_tokens or settings.structured_max_new_tokens, settings.structured_max_new_tokens),
+                "do_sample": False,
+                "stopping_criteria": StoppingCriteriaList([
+                    SchemaStoppingCriteria(self.processor.tokenizer, prompt_ids)
+                ])
+            }
+        return {
+            "max_new_tokens": min(max_new_tokens or 150, 150),
+            "do_sample": True,
+            "temperature": 0.7,
+            "top_p": 0.9
         }
+    
+    def _generate(self, image: Image.Image, prompt: str, structured: bool,
+                  max_new_tokens: Optional[int], digest: Optional[str] = None) -> Tuple[str, int, bool]:
+        """Run generation; returns (text, generated token count, feature cache hit)"""
+        if digest is not None and self.feature_cache.max_bytes and self._feature_path_supported():
+            try:
+                features = self.feature_cache.get(digest)
+                hit = features is not None
+                if not hit:
+                    with span("vision.encode_image"):
+                        features = self._encode_image(image)
+                    self.feature_cache.put(digest, features)
+                text, generated = self._generate_from_features(features, prompt, structured, max_new_tokens)
+                self._feature_path_failures = 0
+                return text, generated, hit
+            except Exception as e:
+                self._feature_path_failed(e)
         
-        return analysis
+        text, generated = self._generate_plain([image], prompt, structured, max_new_tokens)[0]
+        return text, generated, False
     
-    def _extract_application(self, text: str) -> Optional[str]:
-        """Extract application name from response"""
-        apps = ['VSCode', 'Chrome', 'Firefox', 'Terminal', 'Discord', 'Slack', 'YouTube', 'Reddit']
-        text_lower = text.lower()
+    def _generate_batch(self, images: List[Image.Image], prompt: str, structured: bool,
+                        max_new_tokens: Optional[int]) -> List[Tuple[str, int]]:
+        """Run generation for several images; returns (text, generated token count) per image"""
+        if self._feature_path_supported():
+            try:
+                with span("vision.encode_image"):
+                    features = self._encode_images(images)
+                results = self._generate_from_feature_batch(features, prompt, structured, max_new_tokens)
+                self._feature_path_failures = 0
+                return results
+            except Exception as e:
+                self._feature_path_failed(e)
+        return self._generate_plain(images, prompt, structured, max_new_tokens)
+    
+    def _generate_plain(self, images: List[Image.Image], prompt: str, structured: bool,
+                        max_new_tokens: Optional[int]) -> List[Tuple[str, int]]:
+        """Generate through the processor and model.generate, one row per image"""
+        # Process images and prompts
+        with span("vision.processor"):
+            inputs = self.processor(
+                images=images,
+                text=[prompt] * len(images),
+                padding=True,
+                return_tensors="pt"
+            ).to(self.device)
+        # Decoder-only models may echo the prompt ahead of the generated tokens
+        prompt_ids = None if self.model.config.is_encoder_decoder else inputs["input_ids"]
         
-        for app in apps:
-            if app.lower() in text_lower:
-                return app
+        with torch.no_grad(), span("vision.generate"):
+            outputs = self.model.generate(**inputs, **self._generation_kwargs(structured, max_new_tokens, prompt_ids))
         
-        if 'browser' in text_lower or 'web' in text_lower:
-            return 'Browser'
-        elif 'code' in text_lower or 'programming' in text_lower:
-            return 'IDE'
-        elif 'game' in text_lower or 'gaming' in text_lower:
-            return 'Game'
-            
-        return 'Unknown'
+        # Decode only the generated tokens (drops the prompt if it was echoed)
+        with span("vision.decode"):
+            return self._decode_rows(strip_prompt(outputs, prompt_ids))
     
-    def _extract_activity(self, text: str) -> str:
-        """Extract activity type from response"""
-        text_lower = text.lower()
-        
-        if any(word in text_lower for word in ['coding', 'programming', 'debugging', 'error']):
-            return 'coding'
-        elif any(word in text_lower for word in ['gaming', 'playing', 'game']):
-            return 'gaming'
-        elif any(word in text_lower for word in ['watching', 'video', 'youtube']):
-            return 'watching'
-        elif any(word in text_lower for word in ['reading', 'article', 'documentation']):
-            return 'reading'
-        elif any(word in text_lower for word in ['chatting', 'messaging', 'discord']):
-            return 'chatting'
-        else:
-            return 'browsing'
+    def _decode_rows(self, rows: torch.Tensor) -> List[Tuple[str, int]]:
+        """Decode generated token rows; padding after a row finished early is not counted"""
+        pad_id = self.processor.tokenizer.pad_token_id
+        results = []
+        for row in rows:
+            generated = row.shape[0]
+            if pad_id is not None and len(rows) > 1:
+                while generated and row[generated - 1] == pad_id:
+                    generated -= 1
+            results.append((self.processor.decode(row, skip_special_tokens=True).strip(), generated))
+        return results
+    
+    def _feature_path_supported(self) -> bool:
+        """Check once whether the model exposes LLaVA-style image features and an image token"""
+        if self._feature_path is None:
+            config = self.model.config
+            self._image_token_id = getattr(config, "image_token_index", None)
+            if self._image_token_id is None:
+                self._image_token_id = getattr(config, "image_token_id", None)
+            self._feature_path = (
+                hasattr(self.model, "get_image_features")
+                and self._image_token_id is not None
+                and not config.is_encoder_decoder
+            )
+            if not self._feature_path:
+                print("Model has no reusable image feature API, image feature cache disabled")
+        return self._feature_path
     
-    def _extract_user_state(self, text: str) -> str:
-        """Extract user state from response"""
-        text_lower = text.lower()
+    def _feature_path_failed(self, error: Exception):
+        """Fall back to the plain path for this call; give up on features only if the model can't use them
         
-        if any(word in text_lower for word in ['struggling', 'error', 'problem', 'stuck']):
-            return 'struggling'
-        elif any(word in text_lower for word in ['focused', 'working', 'productive']):
-            return 'focused'
-        elif any(word in text_lower for word in ['success', 'victory', 'win', 'achieved']):
-            return 'celebrating'
+        A missing or incompatible API fails the same way on every frame, so it
+        disables the path at once (as do repeated failures). Out-of-memory
+        errors depend on the batch and never count.
+        """
+        if "out of memory" in str(error).lower():
+            print(f"Image feature path ran out of memory, using the plain path: {error}")
+            return
+        self._feature_path_failures += 1
+        if (isinstance(error, (AttributeError, TypeError, NotImplementedError))
+                or self._feature_path_failures >= MAX_FEATURE_PATH_FAILURES):
+            # Model doesn't fit the LLaVA-style feature API after all; use the plain path from now on
+            print(f"Disabling image feature cache: {error}")
+            self._feature_path = False
         else:
-            return 'casual'
+            print(f"Image feature path failed, using the plain path: {error}")
     
-    def _extract_elements(self, text: str) -> list:
-        """Extract notable elements from response"""
-        elements = []
+    def _detect_input_size(self):
+        """Read the size the image processor resizes to, so capture can produce it directly"""
+        image_processor = getattr(self.processor, "image_processor", None)
+        for attr in ("size", "crop_size"):
+            size = getattr(image_processor, attr, None)
+            if isinstance(size, int):
+                size = {"shortest_edge": size}
+            if not isinstance(size, dict):
+                continue
+            if "shortest_edge" in size:
+                self.input_size = (size["shortest_edge"], size["shortest_edge"])
+                self._shortest_edge = True
+                break
+            if "height" in size and "width" in size:
+                self.input_size = (size["width"], size["height"])
+                break
         
-        # Simple keyword extraction
-        keywords = ['error', 'success', 'notification', 'message', 'button', 'form', 'video']
-        text_lower = text.lower()
+        preprocess = getattr(image_processor, "preprocess", None)
+        try:
+            self._can_skip_resize = preprocess is not None and "do_resize" in inspect.signature(preprocess).parameters
+        except (TypeError, ValueError):
+            self._can_skip_resize = False
+        print(f"Model input size: {self.input_size or 'unknown'}")
+    
+    def _is_input_sized(self, image: Image.Image) -> bool:
+        """Check if the processor's resize would leave the image unchanged"""
+        if self.input_size is None:
+            return False
+        if self._shortest_edge:
+            return min(image.size) == self.input_size[0]
+        return image.size == self.input_size
+    
+    def _encode_image(self, image: Image.Image) -> torch.Tensor:
+        """Run the vision tower once and return the projected image features"""
+        return self._encode_images([image])[0]
+    
+    def _encode_images(self, images: List[Image.Image]) -> List[torch.Tensor]:
+        """Run the vision tower on a batch and return each image's projected features"""
+        # Capture already resized the frames; skip the processor's own resample when it would be a no-op
+        input_sized = self._can_skip_resize and all(self._is_input_sized(image) for image in images)
+        preprocess_kwargs = {"do_resize": False} if input_sized else {}
+        pixel_values = self.processor.image_processor(images, return_tensors="pt", **preprocess_kwargs)["pixel_values"]
+        pixel_values = pixel_values.to(self.device, self.dtype)
         
-        for keyword in keywords:
-            if keyword in text_lower:
-                elements.append(keyword)
+        config = self.model.config
+        kwargs = {}
+        for name in ("vision_feature_layer", "vision_feature_select_strategy"):
+            if hasattr(config, name):
+                kwargs[name] = getattr(config, name)
         
-        return elements
+        with torch.no_grad():
+            features = self.model.get_image_features(pixel_values=pixel_values, **kwargs)
+        if isinstance(features, (list, tuple)):
+            if len(images) == 1:
+                features = [torch.cat([f.reshape(-1, f.shape[-1]) for f in features])]
+            elif len(features) != len(images):
+                raise ValueError(f"Got {len(features)} image feature tensors for {len(images)} images")
+        else:
+            features = features.reshape(len(images), -1, features.shape[-1])
+        # Flatten each to (num_image_tokens, hidden) so it can be scattered into any prompt
+        return [f.reshape(-1, f.shape[-1]).detach() for f in features]
     
-    def _calculate_relevance(self, text: str) -> float:
-        """Calculate relevance score for engagement decision"""
-        # Higher relevance for certain keywords
-        high_relevance = ['error', 'success', 'victory', 'achievement', 'stuck', 'help']
-        medium_relevance = ['interesting', 'new', 'learning', 'watching']
+    def _prompt_ids(self, prompt: str, num_image_tokens: int) -> torch.Tensor:
+        """Token ids for the prompt with the image placeholder expanded to num_image_tokens"""
+        key = (prompt, num_image_tokens)
+        ids = self._prompt_ids_cache.get(key)
+        if ids is None:
+            tokenizer = self.processor.tokenizer
+            image_token = tokenizer.convert_ids_to_tokens(self._image_token_id)
+            text = prompt if image_token in prompt else f"{image_token}\n{prompt}"
+            # Analysis prompts and follow-up questions both go through the model's chat template
+            templated = bool(getattr(tokenizer, "chat_template", None))
+            if templated:
+                text = tokenizer.apply_chat_template(
+                    [{"role": "user", "content": text}], tokenize=False, add_generation_prompt=True
+                )
+            base = tokenizer(text, return_tensors="pt", add_special_tokens=not templated)["input_ids"][0]
+            parts = []
+            for token_id in base.tolist():
+                if token_id == self._image_token_id:
+                    parts.extend([token_id] * num_image_tokens)
+                else:
+                    parts.append(token_id)
+            ids = torch.tensor([parts], dtype=torch.long)
+            self._prompt_ids_cache[key] = ids
+        return ids
+    
+    def _generate_from_features(self, features: torch.Tensor, prompt: str, structured: bool,
+                                max_new_tokens: Optional[int]) -> Tuple[str, int]:
+        """Generate from cached image features without re-running the vision tower"""
+        return self._generate_from_feature_batch([features], prompt, structured, max_new_tokens)[0]
+    
+    def _generate_from_feature_batch(self, features: List[torch.Tensor], prompt: str, structured: bool,
+                                     max_new_tokens: Optional[int]) -> List[Tuple[str, int]]:
+        """Generate for several images' features; images with the same token count share one generate call"""
+        groups: Dict[int, List[int]] = {}
+        for index, image_features in enumerate(features):
+            groups.setdefault(image_features.shape[0], []).append(index)
         
-        text_lower = text.lower()
-        score = 0.5  # Base score
+        results: List[Optional[Tuple[str, int]]] = [None] * len(features)
+        for num_image_tokens, indices in groups.items():
+            # Same prompt and token count, so every row has the same length and needs no padding
+            input_ids = self._prompt_ids(prompt, num_image_tokens).to(self.device).repeat(len(indices), 1)
+            
+            with torch.no_grad(), span("vision.generate"):
+                embeds = self.model.get_input_embeddings()(input_ids)
+                image_mask = (input_ids == self._image_token_id).unsqueeze(-1).expand_as(embeds)
+                stacked = torch.cat([features[i] for i in indices])
+                embeds = embeds.masked_scatter(image_mask, stacked.to(embeds.device, embeds.dtype))
+                # With inputs_embeds only, generate returns just the new tokens
+                outputs = self.model.generate(
+                    inputs_embeds=embeds,
+                    attention_mask=torch.ones_like(input_ids),
+                    **self._generation_kwargs(structured, max_new_tokens)
+                )
+            
+            with span("vision.decode"):
+                for index, result in zip(indices, self._decode_rows(outputs)):
+                    results[index] = result
+        return results
+    
+    async def ask_about_frame(self, digest: str, question: str, max_new_tokens: Optional[int] = None) -> Optional[str]:
+        """Answer a follow-up question about a frame whose features are cached"""
+        if not self.is_loaded:
+            return None
+        features = self.feature_cache.get(digest)
+        if features is None:
+            return None
+        async with self._inference_lock:
+            text, _ = await asyncio.to_thread(self._generate_from_features, features, question, False, max_new_tokens)
+        return text
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get backend statistics"""
+        return {
+            "backend": self.name,
+            "feature_cache": self.feature_cache.get_stats()
+        }
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by the model, caches and context buffer"""
+        usage = super().memory_usage()
+        usage["feature_cache"] = self.feature_cache.total_bytes
+        usage["prompt_ids_cache"] = sum(ids.element_size() * ids.nelement() for ids in self._prompt_ids_cache.values())
+        if self._model_bytes is None and self.model is not None:
+            # Memory-mapped snapshot weights count towards RSS only once their pages are touched
+            self._model_bytes = sum(t.element_size() * t.nelement() for t in self.model.parameters())
+        usage["model_parameters"] = self._model_bytes or 0
+        return usage
+    
+    def set_memory_pressure(self, level: int):
+        """Drop and disable the feature cache under pressure; restore it afterwards"""
+        super().set_memory_pressure(level)
+        if level:
+            self.feature_cache.clear()
+            self.feature_cache.max_bytes = 0
+            self._prompt_ids_cache.clear()
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+        else:
+            self.feature_cache.max_bytes = settings.feature_cache_mb * 1024 * 1024
+    
+    def _parse_analysis(self, response: str) -> Dict[str, Any]:
+        """Parse the model's response into structured data"""
+        # One pass over the response classifies application, activity, state,
+        # elements and relevance together
+        analysis = {'description': response}
+        analysis.update(self.classifier.classify(response))
         
-        for word in high_relevance:
-            if word in text_lower:
-                score += 0.3
+        return analysis
+    
+    def _choices(self, category: str) -> List[str]:
+        """A category's labels plus its default (e.g. "browsing"), which has no rule of its own"""
+        labels = list(self.classifier.labels[category])
+        default = self.classifier.defaults.get(category)
+        if default and default not in labels:
+            labels.append(default)
+        return labels
+    
+    def _build_structured_prompt(self) -> str:
+        """Prompt asking for the compact one-line schema, using the classifier's labels"""
+        return (
+            "Classify what the user is doing on their screen. Reply with exactly one line "
+            "in this format and nothing else:\n"
+            f"app=<application or website>;activity=<{'|'.join(self._choices('activity'))}>;"
+            f"state=<{'|'.join(self._choices('user_state'))}>;"
+            f"elements=<comma-separated, e.g. {','.join(self.classifier.labels['notable_elements'])} "
+            "(name any error, crash or failure shown), or none>;"
+            "relevance=<0.0-1.0>;"
+        )
+    
+    def _parse_structured(self, response: str) -> Optional[Dict[str, Any]]:
+        """Parse the compact schema line; None if it is incomplete"""
+        fields = {key.lower(): value.strip() for key, value in SCHEMA_FIELD.findall(response)}
+        if not {'app', 'activity', 'state'} <= fields.keys():
+            return None
         
-        for word in medium_relevance:
-            if word in text_lower:
-                score += 0.1
+        labels = self.classifier.labels
         
-        return min(1.0, score)
-    
-    def _mock_analysis(self, image: Image.Image) -> Dict[str, Any]:
-        """Mock analysis for development without model"""
-        import random
+        def pick(value: str, category: str) -> str:
+            # Exact label first, otherwise let the classifier map free text onto a label
+            for label in self._choices(category):
+                if value.lower() == label.lower():
+                    return label
+            return self.classifier.classify(value)[category]
         
-        activities = [
-            {
-                'description': 'User is coding in VSCode, working on a Python file',
-                'application': 'VSCode',
-                'activity': 'coding',
-                'user_state': 'focused',
-                'notable_elements': ['code', 'python'],
-                'relevance_score': 0.6
-            },
-            {
-                'description': 'User is browsing Reddit, looking at memes',
-                'application': 'Browser',
-                'activity': 'browsing',
-                'user_state': 'casual',
-                'notable_elements': ['reddit', 'memes'],
-                'relevance_score': 0.4
-            },
-            {
-                'description': 'User encountered an error in their code',
-                'application': 'IDE',
-                'activity': 'coding',
-                'user_state': 'struggling',
-                'notable_elements': ['error', 'debugging'],
-                'relevance_score': 0.9
-            }
-        ]
+        # Keep the model's own words for the description (engagement triggers and focus
+        # interrupts match on terms like "crash" that are not element labels)
+        noted = []
+        for item in fields.get('elements', '').split(','):
+            item = item.strip()
+            if item and item.lower() not in ('none', 'n/a') and item not in noted:
+                noted.append(item)
+        known_elements = {label.lower(): label for label in labels['notable_elements']}
+        elements = []
+        for item in noted:
+            mapped = [known_elements[item.lower()]] if item.lower() in known_elements else \
+                self.classifier.classify(item)['notable_elements']
+            elements.extend(label for label in mapped if label not in elements)
         
-        analysis = random.choice(activities)
-        analysis['inference_time'] = random.uniform(0.3, 0.5)
+        application = pick(fields['app'], 'application')
+        if application == 'Unknown' and fields['app'] and fields['app'].lower() not in ('unknown', 'none'):
+            application = fields['app']
         
-        return analysis
-    
-    def get_context_summary(self) -> str:
-        """Get a summary of recent context"""
-        if not self.context_buffer:
-            return "No recent activity"
+        try:
+            relevance = min(1.0, max(0.0, float(fields.get('relevance', ''))))
+        except ValueError:
+            relevance = self.classifier.classify(response)['relevance_score']
         
-        # Get last few activities
-        recent = list(self.context_buffer)[-3:]
-        activities = [item['analysis']['activity'] for item in recent]
+        activity = pick(fields['activity'], 'activity')
+        user_state = pick(fields['state'], 'user_state')
+        description = f"User is {activity} in {application}, looking {user_state}"
+        if noted:
+            description += f" ({', '.join(noted[:MAX_NOTED_ELEMENTS])} visible)"
         
-        # Create summary
-        if len(set(activities)) == 1:
-            return f"User has been {activities[0]} for a while"
-        else:
-            return f"User switched from {activities[0]} to {activities[-1]}"
+        return {
+            'description': description,
+            'application': application,
+            'activity': activity,
+            'user_state': user_state,
+            'notable_elements': elements,
+            'relevance_score': relevance
+        }
     
     def should_comment(self, analysis: Dict[str, Any]) -> bool:
         """Decide if should make a comment based on analysis"""